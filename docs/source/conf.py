@@ -20,6 +20,7 @@ autodoc_mock_imports = [
     'geopandas',
     'pandas',
     'psrcelmerpy',
+    'shapely',
     'yaml',
 ]
 
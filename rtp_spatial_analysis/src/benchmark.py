@@ -0,0 +1,616 @@
+"""
+End-to-end benchmark of the analysis steps on synthetic inputs.
+
+Builds a synthetic, PSRC-sized set of inputs in ``epsg_crs`` (by default
+about 1.3 million parcels, a hex activity unit grid, 20,000 transit stops,
+FGTS lines, ITS signals, tracts with an EFA table and a Soundcast run), then
+runs every step of :data:`run.STEPS` against them, with all outputs going to
+a temporary folder that is removed afterwards. No network drive, OneDrive
+folder or ElmerGeo connection is needed: the ElmerGeo layers are written as
+local snapshots and read with ``elmergeo_offline``.
+
+Each step runs in a fresh spawned process, so its peak RSS is its own and
+its in-memory caches start empty. Besides the wall-clock time and peak RSS
+of the step, the time spent in every module-level function of the package
+modules the step uses is recorded as a stage (inclusive of the functions it
+calls, summed over calls). Results are appended to a JSON history so runs
+can be compared across commits::
+
+    python -m rtp_spatial_analysis.src.benchmark [--scale 0.1] [--steps NAME ...] [-c CONFIGS_DIR]
+
+The synthetic inputs are kept under ``cache_dir/benchmark`` and reused by
+later runs with the same scale and seed. The on-disk caches the steps build
+(layers, parcel lookup, Soundcast mirror, weights) go to a temporary folder,
+so every run is cold unless ``--warm`` is given.
+"""
+
+import argparse
+import contextlib
+import functools
+import inspect
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+from . import configuration
+from . import elmergeo
+from . import export_sink
+from . import layer_cache
+from . import run
+from . import scheduler
+from . import soundcast_cache
+from . import utils
+
+# bump when the synthetic inputs change, so older fixtures are rebuilt
+FIXTURE_VERSION = 1
+# region extent (ft), roughly that of the four counties in EPSG:2285
+EXTENT = (1_100_000, 0, 1_730_000, 530_000)
+# feature counts at scale 1
+SIZES = {
+    'parcels': 1_300_000,
+    'stops': 20_000,
+    'routes': 1_000,
+    'fgts': 2_000,
+    'signals': 4_500,
+    'tracts': 900,
+    'cities': 80,
+    'links': 60_000,
+    'transit_lines': 1_000,
+}
+# hex grid circumradius (ft) at scale 1
+HEX_RADIUS = 1320
+COUNTIES = {'033': 'King', '035': 'Kitsap', '053': 'Pierce', '061': 'Snohomish'}
+EFA_GROUPS = ['poc', 'pov', 'lep', 'dis', 'yth', 'old']
+TIME_PERIODS = ['5to9', '9to3', '3to6', '6to8', '8to5']
+CONGESTION = {'Light': 0.6, 'Moderate': 0.2, 'Heavy': 0.12, 'Severe': 0.08}
+# synthetic input datasets, relative to the fixture folder, by config key
+INPUTS = {
+    'rtp_transit_network_path': 'inputs/Transit_Network_2050.gdb',
+    'activity_units_path': 'inputs/Activity_Units.gdb',
+    'fgtswa_path': 'inputs/FGTSWA.gdb',
+    'its_signals_path': 'inputs/ITS_Signals.gpkg',
+    'au_path': 'inputs/parcel_data.gdb',
+    'rtp_efa_path': 'inputs/efa',
+}
+# package modules whose functions are plumbing rather than stages of a step
+UNTIMED = {'configuration', 'layer_cache', 'export_sink', 'scheduler', 'run', 'benchmark'}
+
+
+def scaled(scale):
+    """Feature counts of the synthetic inputs at ``scale``."""
+    return {name: max(int(round(n * scale)), 10) for name, n in SIZES.items()}
+
+
+def _urban_centers(rng, n=12):
+    """Centers, weights and spreads (ft) of the synthetic activity surface."""
+    xmin, ymin, xmax, ymax = EXTENT
+    xy = np.column_stack([rng.uniform(xmin + 60_000, xmax - 60_000, n),
+                          rng.uniform(ymin + 40_000, ymax - 40_000, n)])
+    weight = rng.gamma(2.0, 1.0, n)
+    return xy, weight / weight.sum(), rng.uniform(12_000, 35_000, n)
+
+
+def _sample_points(rng, centers, n, clustered=0.8):
+    """Points drawn around the urban centers, and uniformly for the rest."""
+    xy, weight, sigma = centers
+    xmin, ymin, xmax, ymax = EXTENT
+    k = rng.choice(len(weight), n, p=weight)
+    points = xy[k] + rng.normal(size=(n, 2)) * sigma[k, None]
+    uniform = rng.uniform(size=n) >= clustered
+    points[uniform] = np.column_stack([rng.uniform(xmin, xmax, uniform.sum()),
+                                       rng.uniform(ymin, ymax, uniform.sum())])
+    return np.clip(points, [xmin, ymin], [xmax, ymax])
+
+
+def _density(centers, x, y):
+    """Activity units per acre of the synthetic surface at points."""
+    xy, weight, sigma = centers
+    d2 = (x[:, None] - xy[:, 0]) ** 2 + (y[:, None] - xy[:, 1]) ** 2
+    return 80 * len(weight) * (weight * np.exp(-d2 / (2 * sigma ** 2))).sum(axis=1)
+
+
+def _random_walks(rng, centers, n, vertices, step):
+    """Polylines wandering from points drawn around the urban centers."""
+    start = _sample_points(rng, centers, n)
+    heading = rng.uniform(0, 2 * np.pi, (n, 1)) + np.cumsum(rng.normal(0, 0.3, (n, vertices - 1)), axis=1)
+    moves = np.stack([np.cos(heading), np.sin(heading)], axis=-1) * step
+    coords = np.concatenate([start[:, None], start[:, None] + np.cumsum(moves, axis=1)], axis=1)
+    return shapely.linestrings(coords)
+
+
+def _county(x, y):
+    """County FIPS code of points, from a rough split of the extent."""
+    xmin, ymin, xmax, ymax = EXTENT
+    county = np.where(y > ymin + 0.68 * (ymax - ymin), '061',
+                      np.where(y < ymin + 0.32 * (ymax - ymin), '053', '033'))
+    return np.where(x < xmin + 0.24 * (xmax - xmin), '035', county)
+
+
+def _hex_grid(radius):
+    """Pointy-top hexagons of ``radius`` covering the extent."""
+    xmin, ymin, xmax, ymax = EXTENT
+    width = np.sqrt(3) * radius
+    ys = np.arange(ymin, ymax + radius, 1.5 * radius)
+    xs = np.arange(xmin, xmax + width, width)
+    cx, cy = np.meshgrid(xs, ys)
+    cx = cx + np.where(np.arange(len(ys)) % 2, width / 2, 0)[:, None]
+    cx, cy = cx.ravel(), cy.ravel()
+    angle = np.deg2rad(np.arange(30, 390, 60))
+    rings = np.stack([cx[:, None] + radius * np.cos(angle), cy[:, None] + radius * np.sin(angle)], axis=-1)
+    return shapely.polygons(rings), cx, cy
+
+
+def _write(config, gdf, path_name, layer):
+    """Write a synthetic input layer to the dataset of ``config[path_name]``."""
+    path = Path(f"{config['user_onedrive']}/{config[path_name]}")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    driver = 'GPKG' if path.suffix == '.gpkg' else 'OpenFileGDB'
+    utils.write_layer(config, gdf, path, layer=layer, driver=driver)
+
+
+def make_fixtures(config, scale=1.0, seed=0):
+    """
+    Write the synthetic inputs of a benchmark run.
+
+    Args:
+        config (dict): Benchmark configuration, see :func:`benchmark_config`.
+        scale (float, optional): Share of the PSRC-sized feature counts
+            (:data:`SIZES`); the hex grid and tracts get coarser with it.
+            Defaults to 1.
+        seed (int, optional): Random seed. Defaults to 0.
+
+    Returns:
+        dict: Feature counts of the inputs written.
+    """
+    rng = np.random.default_rng(seed)
+    crs = config['epsg_crs']
+    sizes = scaled(scale)
+    centers = _urban_centers(rng)
+    counts = {}
+
+    # parcels: small lots, denser around the centers, many without population
+    n = sizes['parcels']
+    xy = _sample_points(rng, centers, n, clustered=0.85)
+    half = rng.uniform(25, 125, (n, 2))
+    population = np.where(rng.uniform(size=n) < 0.45, 0, rng.gamma(1.5, 2.5, n))
+    parcels = gpd.GeoDataFrame({'parcel_id': np.arange(1, n + 1), 'population_2050': population},
+                               geometry=shapely.box(*(xy - half).T, *(xy + half).T), crs=crs)
+    _write(config, parcels, 'au_path', 'draft_parcel_data_rtp_2026')
+    counts['parcels'] = n
+    del parcels, xy, half, population
+
+    # hex activity unit grids of 2050 and 2024
+    hexes, cx, cy = _hex_grid(HEX_RADIUS / np.sqrt(min(scale, 1.0)))
+    acres = shapely.area(hexes) / config['acre_in_sqft']
+    au_2050 = _density(centers, cx, cy) * rng.gamma(2.0, 0.5, len(hexes))
+    au_2024 = au_2050 * rng.uniform(0.5, 1.0, len(hexes))
+    jobs_share = rng.uniform(0.2, 0.6, len(hexes))
+    county = pd.Series(_county(cx, cy)).map(COUNTIES).to_numpy()
+    grid = {'GRID_ID': np.arange(1, len(hexes) + 1), 'county': county}
+    _write(config, gpd.GeoDataFrame({**grid, 'au_acre': au_2050, 'sum_au_205': au_2050 * acres,
+                                     'sum_pop_20': au_2050 * acres * (1 - jobs_share),
+                                     'sum_jobs_2': au_2050 * acres * jobs_share},
+                                    geometry=hexes, crs=crs),
+           'activity_units_path', 'peope_and_jobs_2050')
+    _write(config, gpd.GeoDataFrame({**grid, 'au_acre': au_2024, 'sum_au_202': au_2024 * acres},
+                                    geometry=hexes, crs=crs),
+           'activity_units_path', 'peope_and_jobs_2024')
+    counts['hexes'] = len(hexes)
+
+    # transit stops with route type flags, and routes
+    n = sizes['stops']
+    flags = {'local': 0.8, 'all_day': 0.4, 'frequent': 0.25, 'hct': 0.05, 'brt': 0.05}
+    stops = gpd.GeoDataFrame({key: (rng.uniform(size=n) < p).astype('int32') for key, p in flags.items()},
+                             geometry=shapely.points(_sample_points(rng, centers, n)), crs=crs)
+    _write(config, stops, 'rtp_transit_network_path', 'Transit_Stops_2050')
+    counts['stops'] = n
+
+    n = sizes['routes']
+    agency = rng.choice(['1', '3', '4', '6', '29', '40'], n)
+    routes = gpd.GeoDataFrame({'route_id': [f"{a}_{i}" for i, a in enumerate(agency)],
+                               'route_type': rng.choice([3, 0, 2, 4], n, p=[0.87, 0.05, 0.04, 0.04]),
+                               'agency_id': agency,
+                               'frequent': (rng.uniform(size=n) < 0.3).astype('int32')},
+                              geometry=_random_walks(rng, centers, n, 25, 2000), crs=crs)
+    _write(config, routes, 'rtp_transit_network_path', 'transit_routes_2050')
+    counts['routes'] = n
+
+    # freight corridors and signals
+    n = sizes['fgts']
+    _write(config, gpd.GeoDataFrame({'FGTSClass': rng.choice(['T-1', 'T-2', 'T-3', 'T-4', 'T-5'], n)},
+                                    geometry=_random_walks(rng, centers, n, 12, 3000), crs=crs),
+           'fgtswa_path', 'FGTSWA')
+    counts['fgts'] = n
+
+    # signals: most at intersections along the transit routes
+    n = sizes['signals']
+    vertices = shapely.get_coordinates(routes.geometry.values)
+    signal_xy = _sample_points(rng, centers, n)
+    on_route = rng.uniform(size=n) < 0.6
+    signal_xy[on_route] = vertices[rng.integers(0, len(vertices), on_route.sum())] + \
+        rng.normal(0, 20, (on_route.sum(), 2))
+    signals = gpd.GeoDataFrame({'OBJECTID': np.arange(1, n + 1),
+                                'tsp': rng.choice(['Yes', 'No'], n, p=[0.25, 0.75]),
+                                'ped_signal': rng.choice(['Yes', 'No'], n, p=[0.6, 0.4])},
+                               geometry=shapely.points(signal_xy), crs=crs)
+    _write(config, signals, 'its_signals_path', 'its_signals')
+    counts['signals'] = n
+
+    # tracts, their EFA shares and cities, as ElmerGeo snapshots
+    xmin, ymin, xmax, ymax = EXTENT
+    side = max(int(round(np.sqrt(sizes['tracts']))), 3)
+    xs, ys = np.linspace(xmin, xmax, side + 1), np.linspace(ymin, ymax, side + 1)
+    x0, y0 = (a.ravel() for a in np.meshgrid(xs[:-1], ys[:-1]))
+    x1, y1 = (a.ravel() for a in np.meshgrid(xs[1:], ys[1:]))
+    countyfp = _county((x0 + x1) / 2, (y0 + y1) / 2)
+    tractce = np.char.zfill(np.arange(1, len(x0) + 1).astype(str), 6)
+    tracts = gpd.GeoDataFrame({'geoid20': np.char.add(np.char.add('53', countyfp), tractce),
+                               'countyfp': countyfp,
+                               'county_name': pd.Series(countyfp).map(COUNTIES).to_numpy(),
+                               'tractce20': tractce},
+                              geometry=shapely.box(x0, y0, x1, y1), crs=crs)
+    elmergeo.save_snapshot(config, 'TRACT2020', tracts)
+    counts['tracts'] = len(tracts)
+
+    efa = pd.DataFrame({'GEOID20': tracts['geoid20'].astype('int64')})
+    for group in EFA_GROUPS:
+        efa[f"{group}_prct_est"] = rng.beta(2, 5, len(efa))
+    efa_dir = Path(f"{config['user_onedrive']}/{config['rtp_efa_path']}")
+    efa_dir.mkdir(parents=True, exist_ok=True)
+    efa.to_csv(efa_dir / "equity_focus_areas_2023.csv", index=False)
+
+    n = sizes['cities']
+    cities = gpd.GeoDataFrame({'city_name': [f"City {i}" for i in range(n)]},
+                              geometry=shapely.buffer(shapely.points(_sample_points(rng, centers, n, clustered=0.6)),
+                                                      rng.uniform(5_000, 25_000, n)), crs=crs)
+    elmergeo.save_snapshot(config, 'cities', cities)
+    counts['cities'] = n
+
+    # Soundcast run: links by time period, transit segments and their shapes
+    run_dir = Path(config['2050_model_run_path'])
+    for name in soundcast_cache.FILES:
+        (run_dir / soundcast_cache.FILES[name]).parent.mkdir(parents=True, exist_ok=True)
+    n = sizes['links']
+    start = _sample_points(rng, centers, n)
+    # a quarter of the links start at a signalized intersection
+    at_signal = rng.choice(n, min(len(signal_xy), n // 4), replace=False)
+    start[at_signal] = signal_xy[rng.integers(0, len(signal_xy), len(at_signal))]
+    angle = rng.uniform(0, 2 * np.pi, n)
+    end = start + np.column_stack([np.cos(angle), np.sin(angle)]) * rng.uniform(300, 3000, n)[:, None]
+    pairs = pd.DataFrame({'i_node': rng.integers(1, n, n), 'j_node': rng.integers(1, n, n)})
+    keep = ~pairs.duplicated().to_numpy()
+    pairs, start, end = pairs[keep].reset_index(drop=True), start[keep], end[keep]
+    gpd.GeoDataFrame({'ID': pairs['i_node'].astype(str) + '-' + pairs['j_node'].astype(str)},
+                     geometry=shapely.linestrings(np.stack([start, end], axis=1)), crs=crs
+                     ).to_file(run_dir / soundcast_cache.FILES['emme_links'])
+    links = pairs.loc[pairs.index.repeat(len(TIME_PERIODS))].reset_index(drop=True)
+    links['tod'] = np.tile(TIME_PERIODS, len(pairs))
+    links['congestion_category'] = rng.choice(list(CONGESTION), len(links), p=list(CONGESTION.values()))
+    links['@fgts'] = (rng.uniform(size=len(links)) < 0.15).astype(int)
+    links.to_csv(run_dir / soundcast_cache.FILES['network_results'], index=False)
+    counts['links'] = len(pairs)
+
+    n = sizes['transit_lines']
+    gpd.GeoDataFrame({'ID': np.arange(1, n + 1)},
+                     geometry=_random_walks(rng, centers, n, 25, 2000), crs=crs
+                     ).to_file(run_dir / soundcast_cache.FILES['emme_tlines'])
+    segments = pairs.sample(n=min(len(pairs), 3 * n), random_state=seed, replace=True).reset_index(drop=True)
+    segments['line_id'] = rng.integers(1, n + 1, len(segments))
+    segments['tod'] = rng.choice(TIME_PERIODS, len(segments))
+    segments.to_csv(run_dir / soundcast_cache.FILES['transit_segment_results'], index=False)
+    counts['transit_lines'] = n
+    return counts
+
+
+def fixture_dir(config, scale, seed):
+    """Default folder of the synthetic inputs of a scale and seed."""
+    return layer_cache.cache_root(config) / 'benchmark' / f"scale_{scale:g}_seed_{seed}"
+
+
+def benchmark_config(config, root, cache_dir, output_name='output', workers=None):
+    """
+    Point a configuration at the synthetic inputs.
+
+    Args:
+        config (dict): Configuration dictionary loaded from ``config.yaml``;
+            settings such as buffer distances and modes are kept.
+        root (pathlib.Path): Folder of the synthetic inputs, used as
+            ``user_onedrive``.
+        cache_dir (pathlib.Path): ``cache_dir`` of the steps.
+        output_name (str, optional): Output folder, relative to ``root``.
+            Defaults to ``output``.
+        workers (int, optional): ``scheduler_workers`` of the steps' own
+            process pools. Defaults to the configured value.
+
+    Returns:
+        dict: A new configuration dictionary.
+    """
+    config = dict(config)
+    run_dir = str(Path(root) / 'soundcast')
+    config.update(INPUTS)
+    config.update({
+        'user_onedrive': Path(root),
+        'rtp_output_path': output_name,
+        'cache_dir': str(cache_dir),
+        'elmergeo_snapshot_dir': str(Path(root) / 'elmergeo'),
+        'elmergeo_offline': True,
+        '2050_model_run_path': run_dir,
+        'congestion_model_runs': {'benchmark a': run_dir, 'benchmark b': run_dir},
+        'incremental': False,
+    })
+    if workers is not None:
+        config['scheduler_workers'] = workers
+    return config
+
+
+def ensure_fixtures(config, scale, seed, rebuild=False):
+    """
+    Return the feature counts of the synthetic inputs, writing them if needed.
+
+    Inputs are reused when ``manifest.json`` in the fixture folder records
+    the same :data:`FIXTURE_VERSION`, scale and seed; otherwise the folder
+    is cleared and written again.
+
+    Raises:
+        FileExistsError: If the folder holds other files and no manifest.
+    """
+    root = Path(config['user_onedrive'])
+    manifest = root / 'manifest.json'
+    key = {'version': FIXTURE_VERSION, 'scale': scale, 'seed': seed}
+    if manifest.exists() and not rebuild:
+        saved = json.loads(manifest.read_text())
+        if {k: saved.get(k) for k in key} == key and saved.get('counts'):
+            return saved['counts']
+    if manifest.exists():
+        shutil.rmtree(root)
+    elif root.exists() and any(root.iterdir()):
+        raise FileExistsError(f"{root} is not empty and holds no benchmark inputs")
+    root.mkdir(parents=True, exist_ok=True)
+    # counts are recorded once the inputs are complete
+    manifest.write_text(json.dumps({**key, 'counts': None}, indent=2))
+    start = time.perf_counter()
+    counts = make_fixtures(config, scale, seed)
+    print(f"Wrote synthetic inputs to {root} in {time.perf_counter() - start:.1f}s")
+    manifest.write_text(json.dumps({**key, 'counts': counts}, indent=2))
+    return counts
+
+
+def _timed(name, func, stages):
+    """Wrap a function to add its inclusive time and calls to ``stages[name]``."""
+    def record(seconds):
+        stage = stages.setdefault(name, {'seconds': 0.0, 'calls': 0})
+        stage['seconds'] += seconds
+        stage['calls'] += 1
+
+    if inspect.isgeneratorfunction(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            # time the generator's own work, not that of its consumer
+            gen, seconds = func(*args, **kwargs), 0.0
+            try:
+                while True:
+                    start = time.perf_counter()
+                    try:
+                        item = next(gen)
+                    except StopIteration:
+                        return
+                    finally:
+                        seconds += time.perf_counter() - start
+                    yield item
+            finally:
+                record(seconds)
+    else:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(time.perf_counter() - start)
+    return wrapper
+
+
+def instrument(func, stages):
+    """
+    Time the module-level functions of the package modules a step uses.
+
+    Functions are replaced on their module, so calls through module
+    attributes (``utils.buffer_layer``) and module globals are both timed.
+    The wrappers keep the functions' names, so they still pickle by
+    reference for the steps' own process pools; those processes run the
+    functions untimed.
+
+    Args:
+        func (callable): The step function (left untimed; its total is the
+            step time).
+        stages (dict): Receives ``module.function`` -> seconds and calls.
+    """
+    for module in scheduler.step_modules(func):
+        short = module.__name__.rsplit('.', 1)[-1]
+        if short in UNTIMED:
+            continue
+        for name, value in list(vars(module).items()):
+            if inspect.isfunction(value) and value.__module__ == module.__name__ and value is not func:
+                setattr(module, name, _timed(f"{short}.{name}", value, stages))
+
+
+def _run_step(name, config, log_path):
+    """
+    Run one step in this (fresh) process and report its timings.
+
+    Returns:
+        dict: ``seconds``, ``peak_mb`` and ``stages`` of the step.
+    """
+    step = next(s for s in run.STEPS if s.name == name)
+    stages = {}
+    instrument(step.func, stages)
+    with open(log_path, 'w') as log, contextlib.redirect_stdout(log):
+        with export_sink.collect() as sink:
+            start = time.perf_counter()
+            step.func(config)
+            seconds = time.perf_counter() - start
+        flush_start = time.perf_counter()
+        sink.flush(config)
+        stages['export_sink.flush'] = {'seconds': time.perf_counter() - flush_start, 'calls': 1}
+    return {'seconds': seconds, 'peak_mb': scheduler.peak_rss_mb(),
+            'stages': dict(sorted(stages.items(), key=lambda item: -item[1]['seconds']))}
+
+
+def run_benchmark(config, steps, log_dir):
+    """
+    Run steps one at a time, each in a fresh spawned process.
+
+    Args:
+        config (dict): Benchmark configuration, see :func:`benchmark_config`.
+        steps (list of str): Names of the steps to run.
+        log_dir (pathlib.Path): Folder receiving the printed output of
+            each step, as ``<step>.log``.
+
+    Returns:
+        dict: Step name -> ``status`` (``ok`` or ``failed``), ``seconds``,
+            ``peak_mb`` and ``stages``, or ``error`` for failed steps.
+    """
+    log_dir.mkdir(parents=True, exist_ok=True)
+    results = {}
+    for name in steps:
+        print(f"running {name}")
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+            try:
+                results[name] = {'status': 'ok',
+                                 **pool.submit(_run_step, name, config, log_dir / f"{name}.log").result()}
+            except Exception as e:
+                print(f"Error in {name}: {e} (see {log_dir / f'{name}.log'})")
+                results[name] = {'status': 'failed', 'error': f"{type(e).__name__}: {e}"}
+    return results
+
+
+def git_commit():
+    """Return the short commit of the working tree, or None outside git."""
+    try:
+        out = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=Path(__file__).parent,
+                             capture_output=True, text=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.stdout.strip()
+
+
+def load_history(path):
+    """Return the benchmark records saved at ``path``, oldest first."""
+    path = Path(path)
+    return json.loads(path.read_text()) if path.exists() else []
+
+
+def save_history(path, history):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + ".tmp")
+    tmp_path.write_text(json.dumps(history, indent=2))
+    os.replace(tmp_path, path)
+
+
+def previous_record(history, record):
+    """Latest record of the history run with the same inputs and cache state."""
+    same = ('scale', 'seed', 'warm')
+    for old in reversed(history):
+        if all(old.get(k) == record[k] for k in same):
+            return old
+    return None
+
+
+def print_report(record, previous=None, top=3):
+    """Print the per-step table, with the change from a previous record and the slowest stages."""
+    before = previous['steps'] if previous else {}
+    print(f"\n{'step':<42} {'status':<7} {'seconds':>9} {'change':>8} {'peak MB':>9}")
+    for name, result in record['steps'].items():
+        old = before.get(name, {})
+        seconds, peak = result.get('seconds'), result.get('peak_mb')
+        secs = f"{seconds:9.1f}" if seconds is not None else f"{'-':>9}"
+        change = (f"{seconds / old['seconds'] - 1:+8.0%}" if seconds is not None and old.get('seconds')
+                  else f"{'-':>8}")
+        mb = f"{peak:9.0f}" if peak is not None else f"{'-':>9}"
+        print(f"{name:<42} {result['status']:<7} {secs} {change} {mb}")
+        for stage, timing in list(result.get('stages', {}).items())[:top]:
+            print(f"    {stage:<50} {timing['seconds']:9.1f}s x{timing['calls']}")
+    if previous:
+        print(f"compared with {previous['timestamp']} ({previous.get('commit') or 'unknown commit'})")
+
+
+def main():
+    step_names = [s.name for s in run.STEPS]
+    parser = argparse.ArgumentParser(description="Benchmark the analysis steps on synthetic inputs")
+    configuration.add_run_args(parser)
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='share of the PSRC-sized inputs to generate (default 1)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed of the inputs')
+    parser.add_argument('--steps', nargs='+', choices=step_names, default=step_names, metavar='STEP',
+                        help='steps to run (default all): ' + ', '.join(step_names))
+    parser.add_argument('--workers', type=int, help='scheduler_workers of the steps (default from the config)')
+    parser.add_argument('--fixture-dir', type=Path,
+                        help='folder of the synthetic inputs (default cache_dir/benchmark/scale_<scale>_seed_<seed>)')
+    parser.add_argument('--history', type=Path,
+                        help='JSON history to append to (default cache_dir/benchmark/history.json)')
+    parser.add_argument('--warm', action='store_true',
+                        help='keep the on-disk caches of the steps between runs instead of starting cold')
+    parser.add_argument('--rebuild', action='store_true', help='write the synthetic inputs again')
+    args = parser.parse_args()
+
+    base = configuration.load_config(args.configs_dir)
+    root = args.fixture_dir or fixture_dir(base, args.scale, args.seed)
+    history_path = args.history or layer_cache.cache_root(base) / 'benchmark' / 'history.json'
+
+    # cache and output folders of this run, removed afterwards
+    config = benchmark_config(base, root, cache_dir=root / 'cache', workers=args.workers)
+    counts = ensure_fixtures(config, args.scale, args.seed, rebuild=args.rebuild)
+    output = Path(tempfile.mkdtemp(prefix='output_', dir=root))
+    cold_cache = None if args.warm else Path(tempfile.mkdtemp(prefix='cache_', dir=root))
+    config = benchmark_config(base, root, cache_dir=cold_cache or root / 'cache',
+                              output_name=output.name, workers=args.workers)
+
+    start = time.perf_counter()
+    try:
+        results = run_benchmark(config, args.steps, root / 'logs')
+    finally:
+        shutil.rmtree(output, ignore_errors=True)
+        if cold_cache is not None:
+            shutil.rmtree(cold_cache, ignore_errors=True)
+
+    record = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'scale': args.scale,
+        'seed': args.seed,
+        'warm': args.warm,
+        'workers': int(config.get('scheduler_workers', 1)),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'inputs': counts,
+        'seconds': time.perf_counter() - start,
+        'steps': results,
+    }
+    history = load_history(history_path)
+    print_report(record, previous_record(history, record))
+    history.append(record)
+    save_history(history_path, history)
+    print(f"Saved to {history_path}")
+
+    if any(result['status'] == 'failed' for result in results.values()):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,9 @@
 import argparse
+import getpass
 from pathlib import Path
 
+import yaml
+
 def add_run_args(parser, multiprocess=True):
     """
     Run command args
@@ -18,5 +21,23 @@ add_run_args(parser)
 args, _ = parser.parse_known_args()
 
 
+def load_config(configs_dir=None):
+    """
+    Load config.yaml and locate the user's OneDrive folder
+    """
+    file = Path().joinpath(configs_dir or args.configs_dir, "config.yaml")
+
+    config = yaml.safe_load(open(file))
+
+    if Path().joinpath("C:/Users/", getpass.getuser(), "PSRC").exists():
+        config['user_onedrive'] = Path().joinpath("C:/Users/", getpass.getuser(), "PSRC")
+    elif Path().joinpath("C:/Users/", getpass.getuser(), "Puget Sound Regional Council").exists():
+        config['user_onedrive'] = Path().joinpath("C:/Users/", getpass.getuser(), "Puget Sound Regional Council")
+    else:
+        print("OneDrive path not found")
+
+    return config
+
+
 if __name__ == '__main__':
     print(f"configs_dir: {args.configs_dir}")
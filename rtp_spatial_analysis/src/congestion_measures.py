@@ -1,51 +1,243 @@
-from pathlib import Path
-import geopandas as gpd
+import multiprocessing
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import pandas as pd
+import shapely
+from . import soundcast_cache
 from . import utils
 
 # Heavy or Severe Congestion and FGTS routes
   
 # Frequent Transit Routes and Heavy or Severe Congestion
 
+# congestion categories counted as heavy or severe congestion
+CONGESTED = ['Heavy', 'Severe']
+# node-pair key of links or segments with a missing node; never matches
+NA_KEY = -1
+# time period column of the Soundcast results, and the label of whole-day results
+TIME_PERIOD = 'tod'
+ALL_DAY = 'all day'
+# distance (ft) within which a signal is on a model link
+SIGNAL_MATCH_FT = 20
+
+# columns read from the Soundcast results and their dtypes when read from CSV (None: inferred)
+LINK_DTYPES = {'i_node': 'Int64', 'j_node': 'Int64', TIME_PERIOD: 'category',
+               'congestion_category': 'category', '@fgts': 'float32'}
+SEGMENT_DTYPES = {'i_node': 'Int64', 'j_node': 'Int64', 'line_id': None, TIME_PERIOD: 'category'}
+
+ModelRun = namedtuple("ModelRun", ["links", "segments", "link_gdf", "tlines"])
+
+
+def node_pair_key(i_node, j_node):
+    """
+    Pack (i_node, j_node) pairs into single int64 keys.
+
+    The key is ``i_node << 32 | j_node``, which is unique for Emme node
+    numbers below 2**31 and avoids building an "i-j" string per link.
+
+    Args:
+        i_node (array-like): From node numbers, may contain NA.
+        j_node (array-like): To node numbers, may contain NA.
+
+    Returns:
+        numpy.ndarray: int64 keys, ``NA_KEY`` where either node is missing.
+    """
+    i_node = pd.array(i_node, dtype='Int64')
+    j_node = pd.array(j_node, dtype='Int64')
+    key = (i_node.to_numpy(dtype='int64', na_value=0) << 32) | j_node.to_numpy(dtype='int64', na_value=0)
+    key[np.asarray(i_node.isna() | j_node.isna())] = NA_KEY
+    return key
+
+
+def link_id_key(link_ids):
+    """
+    Node-pair keys of Emme link IDs of the form "i-j".
+
+    Args:
+        link_ids (pandas.Series): ``ID`` field of ``emme_links.shp``.
+
+    Returns:
+        numpy.ndarray: int64 keys, see :func:`node_pair_key`.
+    """
+    nodes = link_ids.astype(str).str.split('-', n=1, expand=True).reindex(columns=[0, 1])
+    return node_pair_key(pd.to_numeric(nodes[0], errors='coerce').astype('Int64'),
+                         pd.to_numeric(nodes[1], errors='coerce').astype('Int64'))
+
+
+def in_keys(keys, wanted):
+    """
+    Boolean mask of the node-pair ``keys`` found in ``wanted``.
+
+    A sorted-array join (``numpy.isin``); ``NA_KEY`` never matches.
+    """
+    wanted = np.asarray(wanted)
+    return np.isin(keys, np.unique(wanted[wanted != NA_KEY]))
+
+
 def congested_transit_segments(congested_links, transit_segments, transit_routes):   
-    congested_transit_segments=transit_segments[transit_segments['ij'].isin(congested_links['ij'])]
-    congested_transit_lines=congested_transit_segments.line_id.unique().tolist()
+    congested_transit_segments=transit_segments[in_keys(transit_segments['ij_key'].to_numpy(), congested_links['ij_key'])]
+    congested_transit_lines=congested_transit_segments.line_id.unique()
     congested_transit_routes=transit_routes[transit_routes['ID'].isin(congested_transit_lines)]
     return congested_transit_routes
 
 
+def read_model_run(config, run_dir, columns=None):
+    """
+    Read the outputs of one Soundcast model run used by the congestion measures.
+
+    Each file is read once, through the local Parquet mirror of
+    :mod:`soundcast_cache` when it is enabled; the link and segment tables
+    get an ``ij_key`` column (see :func:`node_pair_key`).
+
+    Args:
+        config (dict): Configuration dictionary.
+        run_dir (str or pathlib.Path): Soundcast run directory.
+        columns (list, optional): Attribute columns read from the link and
+            transit line shapefiles. Defaults to None (all columns).
+
+    Returns:
+        ModelRun: links, segments, link_gdf and tlines of the run.
+    """
+    links = soundcast_cache.read_table(config, run_dir, 'network_results', LINK_DTYPES)
+    links['ij_key'] = node_pair_key(links['i_node'], links['j_node'])
+    segments = soundcast_cache.read_table(config, run_dir, 'transit_segment_results', SEGMENT_DTYPES)
+    segments['ij_key'] = node_pair_key(segments['i_node'], segments['j_node'])
+    link_gdf = soundcast_cache.read_layer(config, run_dir, 'emme_links', columns=columns)
+    tlines = soundcast_cache.read_layer(config, run_dir, 'emme_tlines', columns=columns)
+    return ModelRun(links, segments, link_gdf, tlines)
+
+
+def signal_link_pairs(signals, link_gdf, link_keys, distance=SIGNAL_MATCH_FT):
+    """
+    Pairs of signals and the model links within ``distance`` of them.
+
+    Args:
+        signals (geopandas.GeoDataFrame): ITS signals.
+        link_gdf (geopandas.GeoDataFrame): Model links from ``emme_links.shp``,
+            reprojected to the CRS of ``signals`` if it differs.
+        link_keys (numpy.ndarray): Node-pair key of each link.
+        distance (float, optional): Search distance in feet. Defaults to
+            ``SIGNAL_MATCH_FT``.
+
+    Returns:
+        pandas.DataFrame: ``signal`` (position in ``signals``) and ``ij_key``.
+    """
+    link_gdf = utils.to_crs_of(link_gdf, signals)
+    tree = shapely.STRtree(link_gdf.geometry.values)
+    signal_idx, link_idx = tree.query(signals.geometry.values, predicate='dwithin', distance=distance)
+    return pd.DataFrame({'signal': signal_idx, 'ij_key': link_keys[link_idx]})
+
+
+def period_measures(model, link_keys, pairs, time_period=None):
+    """
+    Congestion measures of one model run for one time period.
+
+    Args:
+        model (ModelRun): Output of :func:`read_model_run`.
+        link_keys (numpy.ndarray): Node-pair key of each link of ``model.link_gdf``.
+        pairs (pandas.DataFrame): Output of :func:`signal_link_pairs`.
+        time_period (str, optional): A ``tod`` value; None for links
+            congested in any time period.
+
+    Returns:
+        dict: Measure name -> count.
+    """
+    links, segments = model.links, model.segments
+    if time_period is not None:
+        links = links[links[TIME_PERIOD] == time_period]
+        if TIME_PERIOD in segments:
+            segments = segments[segments[TIME_PERIOD] == time_period]
+    congested = links[links['congestion_category'].isin(CONGESTED)]
+    congested_keys = congested['ij_key'].to_numpy()
+    fgts_keys = congested.loc[congested['@fgts'] > 0, 'ij_key'].to_numpy()
+    return {
+        'congested_links': int(in_keys(link_keys, congested_keys).sum()),
+        'congested_fgts_links': int(in_keys(link_keys, fgts_keys).sum()),
+        'congested_transit_routes': len(congested_transit_segments(congested, segments, model.tlines)),
+        'congested_signals': pairs.loc[in_keys(pairs['ij_key'].to_numpy(), congested_keys), 'signal'].nunique(),
+    }
+
+
+def scenario_measures(config, scenario, run_dir):
+    """
+    Congestion measures of one model run, for the whole day and each time period.
+
+    The run's files are read and the signals matched to its links once; every
+    time period is then a set of key lookups.
+
+    Args:
+        config (dict): Configuration dictionary.
+        scenario (str): Label of the model run.
+        run_dir (str or pathlib.Path): Soundcast run directory.
+
+    Returns:
+        pandas.DataFrame: Long table with ``scenario``, ``time_period``,
+            ``measure`` and ``value``.
+    """
+    model = read_model_run(config, run_dir, columns=['ID'])
+    link_keys = link_id_key(model.link_gdf['ID'])
+    signals = utils.get_onedrive_layer(config, 'its_signals_path', 'its_signals')
+    pairs = signal_link_pairs(signals, model.link_gdf, link_keys)
+
+    periods = [None]
+    if TIME_PERIOD in model.links:
+        periods += list(model.links[TIME_PERIOD].dropna().unique())
+    rows = []
+    for time_period in periods:
+        for measure, value in period_measures(model, link_keys, pairs, time_period).items():
+            rows.append({'scenario': scenario, 'time_period': time_period or ALL_DAY,
+                         'measure': measure, 'value': value})
+    return pd.DataFrame(rows)
+
+
+def run_batch(config):
+    """
+    Compare the congestion measures of several model runs by time period.
+
+    Model runs are listed in ``congestion_model_runs`` (label -> Soundcast
+    run directory) and processed in parallel, up to ``scheduler_workers`` at
+    a time. The long-format table is written to
+    ``congestion_measures_comparison.csv``.
+    """
+    runs = config['congestion_model_runs']
+    workers = min(len(runs), int(config.get('scheduler_workers', 1)))
+    if workers <= 1:
+        results = [scenario_measures(config, scenario, run_dir) for scenario, run_dir in runs.items()]
+    else:
+        with ProcessPoolExecutor(max_workers=workers,
+                                 mp_context=multiprocessing.get_context("spawn")) as pool:
+            futures = [pool.submit(scenario_measures, config, scenario, run_dir)
+                       for scenario, run_dir in runs.items()]
+            results = [future.result() for future in futures]
+
+    df = pd.concat(results, ignore_index=True)
+    utils.export_csv(df, config, "congestion_measures_comparison.csv")
+    print('done')
+
+
 def run(config):
-    model_links = pd.read_csv(Path(config['2050_model_run_path'])/"outputs/network/network_results.csv")
-    model_links_gdf = gpd.read_file(Path(config['2050_model_run_path'])/"outputs/network/shapefile/emme_links.shp")    
-    #model_links["ij"] = model_links["i_node"].astype(str) + "-" + model_links["j_node"].astype(str)
-    congested_links = model_links[model_links['congestion_category'].isin(['Heavy', 'Severe'])]
-    congested_model_links_gdf = model_links_gdf[model_links_gdf['ID'].isin(congested_links['ij'])]
+    model = read_model_run(config, config['2050_model_run_path'])
+    model_links, model_links_gdf = model.links, model.link_gdf
+    # parse the "i-j" link IDs once
+    link_keys = link_id_key(model_links_gdf['ID'])
+    congested_links = model_links[model_links['congestion_category'].isin(CONGESTED)]
+    congested_model_links_gdf = model_links_gdf[in_keys(link_keys, congested_links['ij_key'])]
     congested_fgts = congested_links[congested_links['@fgts'] > 0]
-    congested_fgts = model_links_gdf[model_links_gdf['ID'].isin(congested_fgts['ij'])]
+    congested_fgts = model_links_gdf[in_keys(link_keys, congested_fgts['ij_key'])]
     utils.export_layer(congested_fgts, config, "congested_fgts")
 
-    model_transit_segments = pd.read_csv(Path(config['2050_model_run_path'])/"outputs/transit/transit_segment_results.csv", dtype={'i_node': 'Int64', 'j_node': 'Int64'})
-    model_transit_segments["i_node"].fillna(0).astype(int)
-    model_transit_segments["j_node"].fillna(0).astype(int)
-    model_transit_segments["ij"] = model_transit_segments["i_node"].astype(str) + "-" + model_transit_segments["j_node"].astype(str)
-    
-    model_transit_routes = gpd.read_file(Path(config['2050_model_run_path'])/"outputs/network/shapefile/emme_tlines.shp")
-    congested_transit_routes = congested_transit_segments(congested_links, model_transit_segments, model_transit_routes) 
+    congested_transit_routes = congested_transit_segments(congested_links, model.segments, model.tlines) 
     utils.export_layer(congested_model_links_gdf, config, "congested_links")
   
-    signals_gdf = gpd.read_file(Path(f"{config['user_onedrive']}/{config['rtp_its_signals_path']}/ITS_Signals_2024_Final.gdb"), layer="its_signals")
-    signals_gdf = signals_gdf.to_crs(2285)
-    signals_gdf.geometry = signals_gdf.geometry.buffer(20)  # buffer 100 feet to ensure intersection   
+    signals_gdf = utils.get_onedrive_layer(config, 'its_signals_path', 'its_signals')
     print(signals_gdf)
     print("signals done")
 
-    signals_in_congested_links_gdf = gpd.sjoin(
-        signals_gdf,
-        congested_model_links_gdf,
-        how="inner",
-        predicate="intersects"      
+    # signals within 20 feet of a congested link, with the nearest one
+    signals_in_congested_links_gdf = utils.match_points_to_lines(
+        signals_gdf, congested_model_links_gdf, SIGNAL_MATCH_FT
     )
-    signals_in_congested_links_gdf=signals_in_congested_links_gdf.drop_duplicates(subset='OBJECTID')
     
     utils.export_layer(signals_in_congested_links_gdf, config, "congested_signals")
        
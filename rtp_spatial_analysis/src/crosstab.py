@@ -0,0 +1,35 @@
+"""
+Long-format counts of several attributes in one grouped aggregation.
+
+Summaries such as "signals with TSP by density tier and county" and
+"accessible pedestrian signals by density tier and county" are cuts of the
+same joined table. :func:`attribute_counts` stacks the attributes into one
+long column and counts every (attribute, value, grouping) combination in a
+single groupby, so another attribute or grouping column is another row of
+the result rather than another join.
+"""
+
+
+def attribute_counts(df, attributes, by=()):
+    """
+    Count the rows of every value of every attribute, by grouping columns.
+
+    Args:
+        df (pandas.DataFrame): Table to summarize, e.g. signals joined to
+            the hex grid.
+        attributes (list): Columns whose values are counted, e.g. ``tsp``
+            and ``ped_signal``.
+        by (list, optional): Grouping columns, e.g. density tier and county.
+            Defaults to no grouping.
+
+    Returns:
+        pandas.DataFrame: Long table with ``attribute``, ``value``, the
+            ``by`` columns and ``count``. Missing values are counted as
+            their own value; combinations without rows are left out.
+    """
+    by = list(by)
+    long = df[by + list(attributes)].melt(id_vars=by, value_vars=list(attributes),
+                                          var_name='attribute', value_name='value')
+    return (long.groupby(['attribute', 'value'] + by, observed=True, dropna=False, sort=True)
+            .size()
+            .reset_index(name='count'))
@@ -8,11 +8,18 @@ in the Regional Transportation Plan.
 
 The analysis involves:
 
-* Buffering FGTS polyline routes (T-1 and T-2 classifications)
-* Intersecting the buffered zones with activity unit hex grid layers
-* Calculating and summarizing activity units within the buffer zones
+* Buffering FGTS polyline routes (T-1 and T-2 classifications) and
+  dissolving the buffers into one corridor
+* Computing the share of each hex of the activity unit grid that lies
+  within the corridor (see :mod:`zonal_weights`)
+* Applying those shares to the activity units of every analysis year
 * Comparing regional totals against values within freight corridors
 
+The corridor is built once. The shares are keyed by the hex grid, so when
+the years listed in ``freight_au_years`` share a grid it is intersected with
+the corridor only once and each further year only adds a dot product; a
+year whose grid differs gets shares of its own.
+
 Example
 -------
 To run the full density and freight analysis::
@@ -26,74 +33,71 @@ To run the full density and freight analysis::
 """
 
 import pandas as pd
-import geopandas as gpd
-import psrcelmerpy
+import shapely
 from pathlib import Path 
 from . import configuration
 from . import utils
+from . import zonal_weights
+
+# FGTS classes analysed and the buffer distance (ft) around them
+FGTS_CLASSES = ['T-1', 'T-2']
+BUFFER_FT = 500
 
 
-def buffer_and_combine(line_layer, hex_layer):
+def fgts_corridor(line_layer, distance=BUFFER_FT):
     """
-    Buffer a polyline layer and intersect it with a hex grid layer.
+    Buffer a polyline layer and dissolve the buffers into one polygon.
     
-    Creates a 500-foot buffer around the input polyline features and 
-    performs a spatial intersection with the provided hexagonal grid layer.
-    This is commonly used to identify activity units that fall within 
-    proximity of transportation routes.
+    Overlapping buffers of neighbouring or parallel routes are merged, so an 
+    area close to several routes is counted once.
     
     :param line_layer: A GeoDataFrame containing polyline geometry features 
         (e.g., FGTS routes) to be buffered.
     :type line_layer: geopandas.GeoDataFrame
-    :param hex_layer: A GeoDataFrame containing hexagonal grid polygons with 
-        activity unit data to intersect with the buffer.
-    :type hex_layer: geopandas.GeoDataFrame
+    :param distance: Buffer distance in feet. Defaults to ``BUFFER_FT``.
+    :type distance: float
     
-    :returns: A GeoDataFrame containing the intersection of the buffered 
-        polylines and the hex grid, preserving attributes from both layers.
-    :rtype: geopandas.GeoDataFrame
+    :returns: The dissolved corridor.
+    :rtype: shapely.Geometry
     
-    :raises Exception: If buffering or intersection operations fail due to 
-        invalid geometries or other spatial processing errors.
+    :raises Exception: If buffering or dissolving fails due to invalid 
+        geometries or other spatial processing errors.
     
     .. seealso::
-        :func:`utils.buffer_layer`, :func:`utils.intersect_layers`
+        :func:`utils.buffer_layer`
     """
 
     try:
-        buffered_gdf = utils.buffer_layer(line_layer, 500)
-        intersected = utils.intersect_layers(buffered_gdf, hex_layer)
-        return intersected
+        buffered_gdf = utils.buffer_layer(line_layer, distance)
+        return shapely.union_all(buffered_gdf.geometry.values)
 
     except Exception as e:
-        print(f"Error in buffer_and_combine: {e}")
+        print(f"Error in fgts_corridor: {e}")
         raise
 
-def export_shp(gdf):
+def export_shp(gdf, config):
     """
-    Export a GeoDataFrame to a shapefile at a pre-defined file location.
+    Export a GeoDataFrame to a shapefile in the output folder.
     
-    Writes the provided GeoDataFrame to a hardcoded output path. This function 
-    is primarily used for debugging or interim data exports during development.
+    Writes the provided GeoDataFrame to ``out_shape.shp`` in the configured 
+    output folder. This function is primarily used for debugging or interim 
+    data exports during development.
     
     :param gdf: The GeoDataFrame to export as a shapefile.
     :type gdf: geopandas.GeoDataFrame
+    :param config: Configuration dictionary containing ``'user_onedrive'`` 
+        and ``'rtp_output_path'``.
+    :type config: dict
     
     :returns: None
     :rtype: None
     
     :raises Exception: If the file export fails due to permission issues, 
         invalid path, or geometry errors.
-    
-    .. warning::
-        This function uses a hardcoded file path 
-        (``C:/Users/cpeak/temp/rtp_spatial_analysis_exports/out_shape.shp``).
-        Consider using a configurable path for production use.
     """
 
     try:
-        pth = Path("C:/Users/cpeak/temp/rtp_spatial_analysis_exports/out_shape.shp")
-        pth = Path(config['rtp_output_path']) / "out_shape.shp"
+        pth = Path(f"{config['user_onedrive']}/{config['rtp_output_path']}") / "out_shape.shp"
         gdf.to_file(pth)
 
     except Exception as e:
@@ -101,58 +105,35 @@ def export_shp(gdf):
         raise
 
 
-def sum_combined(gdf, au_col_name, config):
+def hex_activity_units(gdf, au_col_name, config):
     """
-    Calculate the sum of activity units in a GeoDataFrame.
+    Calculate the activity units of each hex of a grid.
     
-    Computes the total activity units by:
+    Activity units per hex are ``au_acre`` (activity units per acre) times 
+    the hex acreage, which is what the area weighting of 
+    :func:`zonal_weights.weighted_sum` apportions. The regional total uses the ``au_col_name`` column.
     
-    1. Extracting relevant columns including geometry and activity units per acre
-    2. Calculating the acreage of each polygon from its geometry
-    3. Multiplying activity units per acre by acreage to get total activity units
-    4. Summing all activity units across the GeoDataFrame
-    
-    :param gdf: A GeoDataFrame containing polygon geometries with activity unit 
-        density data. Must include columns for ``GRID_ID``, the activity unit 
-        column specified by ``au_col_name``, ``au_acre`` (activity units per acre), 
+    :param gdf: A GeoDataFrame containing the hex grid with ``GRID_ID``, 
+        ``au_acre``, the activity unit column specified by ``au_col_name`` 
         and ``geometry``.
     :type gdf: geopandas.GeoDataFrame
     :param au_col_name: The name of the column containing activity unit values 
         (e.g., ``'sum_au_205'`` for 2050 data or ``'sum_au_202'`` for 2024 data).
     :type au_col_name: str
-    :param config: Configuration dictionary containing conversion factors. 
-        Must include the key ``'acre_in_sqft'`` specifying square feet per acre.
+    :param config: Configuration dictionary. Must include the key 
+        ``'acre_in_sqft'`` specifying square feet per acre.
     :type config: dict
     
-    :returns: The total sum of activity units across all polygons in the 
-        GeoDataFrame.
-    :rtype: float
-    
-    :raises KeyError: If required columns are missing from the GeoDataFrame 
-        or if ``'acre_in_sqft'`` is not in the config dictionary.
-    :raises Exception: If calculation fails due to invalid data types or 
-        other processing errors.
+    :returns: Activity units per hex indexed by ``GRID_ID``, and the regional 
+        total.
+    :rtype: tuple(pandas.Series, float)
     
     .. note::
-        NaN values in ``au_acre`` and ``acreage`` columns are filled with 0 
-        before multiplication to prevent null results.
+        NaN values in ``au_acre`` are filled with 0 to prevent null results.
     """
-    try:
-        c = gdf[['GRID_ID', 
-                au_col_name, 
-                'au_acre', 
-                'geometry']].copy()
-
-        acre_in_sqft = config['acre_in_sqft']
-        c['acreage'] = c['geometry'].area / acre_in_sqft # calculate acreage for new polygons
-        c['au'] = c['au_acre'].fillna(0) * c['acreage'].fillna(0) # calculate au for acreage
-        s = c.au.sum() # sum the au's
-        return(s)
-
-    except Exception as e:
-        print(f"Error in sum_combined: {e}")
-        raise
-
+    acreage = gdf.geometry.area.to_numpy() / config['acre_in_sqft']
+    au = gdf['au_acre'].fillna(0).to_numpy() * acreage
+    return pd.Series(au, index=gdf['GRID_ID'].to_numpy()), gdf[au_col_name].sum()
 
 
 def run(config):
@@ -166,17 +147,20 @@ def run(config):
     The workflow performs the following steps:
     
     1. Loads FGTS route data and filters for T-1 and T-2 classifications
-    2. Loads activity unit data for both 2050 (projected) and 2024 (current) years
-    3. Creates 500-foot buffers around FGTS routes
-    4. Intersects buffers with activity unit hex grids
-    5. Calculates regional totals and buffer-specific totals
-    6. Exports results to a CSV summary table
+    2. Creates 500-foot buffers around FGTS routes and dissolves them
+    3. Loads activity unit data for every year in ``freight_au_years``
+    4. Computes the share of each hex within the buffers, in the 
+       ``zonal_weights_mode`` mode, and applies it to that year's activity 
+       units; years on the same grid reuse the shares
+    5. Exports regional and buffer-specific totals to a CSV summary table
     
     :param config: Configuration dictionary containing file paths and settings.
         Required keys include:
         
         * ``'fgtswa_path'``: Path to FGTS routes layer
         * ``'activity_units_path'``: Path to activity units data
+        * ``'freight_au_years'``: Year -> activity unit layer and column
+        * ``'zonal_weights_mode'``: ``exact`` (default) or ``centroid``
         * ``'acre_in_sqft'``: Conversion factor for area calculations
         * Output path settings for CSV export
         
@@ -188,6 +172,7 @@ def run(config):
     :raises FileNotFoundError: If input data files specified in config cannot 
         be found.
     :raises KeyError: If required configuration keys are missing.
+    :raises ValueError: If ``GRID_ID`` is not unique in an activity unit layer.
     :raises Exception: If spatial processing or data export operations fail.
     
     **Output Format**
@@ -199,36 +184,37 @@ def run(config):
     ==================== ================================================
     selection            Either 'regional total' or 'within 500 ft of 
                          FGTS routes'
-    activity units 2050  Projected activity units for 2050
-    activity units 2024  Current activity units for 2024
+    activity units YYYY  Activity units of each year of 
+                         ``freight_au_years``, e.g. 2050 and 2024
     ==================== ================================================
     
     .. seealso::
-        :func:`buffer_and_combine`, :func:`sum_combined`, 
-        :func:`utils.export_csv`
+        :func:`fgts_corridor`, :func:`zonal_weights.get_weights`, 
+        :func:`zonal_weights.weighted_sum`, :func:`utils.export_csv`
     """
 
     try:
 
         fgtswa = utils.get_onedrive_layer(config, 'fgtswa_path', 'FGTSWA')
-        fgtswa = fgtswa[fgtswa['FGTSClass'].isin(['T-1', 'T-2'])]
-        #activity_units_2050 = utils.get_onedrive_layer(config, 'activity_units_path', 'peope_and_jobs_2050')
-
-        au2050 = utils.get_onedrive_layer(config, 'activity_units_path', 'peope_and_jobs_2050')
-        combined_gdf = buffer_and_combine(fgtswa, au2050)
-        total_au_2050 = au2050.sum_au_205.sum()
-        summed_2050 = sum_combined(combined_gdf, 'sum_au_205', config)
-
-        au2024 = utils.get_onedrive_layer(config, 'activity_units_path', 'peope_and_jobs_2024')
-        combined_gdf = buffer_and_combine(fgtswa, au2024)
-        total_au_2024 = au2024.sum_au_202.sum()
-        summed_2024 = sum_combined(combined_gdf, 'sum_au_202', config)
-        
-        df = pd.DataFrame({
-            'selection': ['regional total', 'within 500 ft of FGTS routes'],
-            'activity units 2050': [total_au_2050, summed_2050],
-            'activity units 2024': [total_au_2024, summed_2024],
-        })
+        fgtswa = fgtswa[fgtswa['FGTSClass'].isin(FGTS_CLASSES)]
+        corridor = fgts_corridor(fgtswa)
+
+        summed, totals = {}, {}
+        for year, (layer, au_col_name) in config['freight_au_years'].items():
+            au = utils.get_onedrive_layer(config, 'activity_units_path', layer)
+            if au['GRID_ID'].duplicated().any():
+                raise ValueError(f"GRID_ID is not unique in activity unit layer {layer!r}")
+            # weights are keyed by the grid's ids and geometry, so a year on
+            # the same grid as an earlier one reuses its weights and a year
+            # whose grid differs gets weights computed on that grid
+            weights = zonal_weights.get_weights(config, 'fgts_corridor', corridor, au, 'GRID_ID',
+                                                how=config.get('zonal_weights_mode', 'exact'))
+            hex_au, totals[year] = hex_activity_units(au, au_col_name, config)
+            summed[year] = zonal_weights.weighted_sum(weights, hex_au.to_frame(year))[year]
+
+        df = pd.DataFrame({'selection': ['regional total', f'within {BUFFER_FT} ft of FGTS routes']})
+        for year in totals:
+            df[f'activity units {year}'] = [totals[year], summed[year]]
         utils.export_csv(df, config, 'density_and_freight.csv')
         print(f"Finished Density and Freight export")
         
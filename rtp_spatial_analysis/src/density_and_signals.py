@@ -1,14 +1,98 @@
+import numpy as np
 import pandas as pd
-import geopandas as gpd
-import psrcelmerpy
-from pathlib import Path 
+import shapely
+from . import crosstab
 from . import utils
 
+# activity units per acre at which a hex moves up a density tier, and
+# the tier labels (one more label than thresholds)
+DENSITY_THRESHOLDS = [25]
+DENSITY_LABELS = ['low density', 'high density']
+
+
+def density_tiers(au_acre, thresholds=DENSITY_THRESHOLDS, labels=DENSITY_LABELS, inclusive=False):
+    """
+    Classify activity unit densities into tiers, for any number of thresholds.
+
+    A value above a threshold (strictly, or also at it with ``inclusive``)
+    is in the next tier; missing values are in the lowest tier.
+
+    Args:
+        au_acre (pandas.Series): Activity units per acre.
+        thresholds (list, optional): Increasing tier thresholds. Defaults to
+            ``DENSITY_THRESHOLDS``.
+        labels (list, optional): Tier labels, one more than thresholds.
+            Defaults to ``DENSITY_LABELS``.
+        inclusive (bool, optional): Put a value equal to a threshold in the
+            higher tier, as the ``au_acre >= density`` test of
+            :func:`transit_stop_intersections.result_au_service` does.
+            Defaults to False, the strict ``au_acre > 25`` high-density test.
+
+    Returns:
+        pandas.Series: Tier label of each value, indexed like ``au_acre``.
+    """
+    codes = np.searchsorted(np.asarray(thresholds, dtype=float),
+                            au_acre.fillna(-np.inf).to_numpy(dtype=float),
+                            side='right' if inclusive else 'left')
+    return pd.Series(np.asarray(labels, dtype=object)[codes], index=au_acre.index)
+
+
+def supportive_density_tiers(config):
+    """
+    Density tiers of the thresholds in ``transit_supportive_density``.
+
+    A hex at a threshold is supportive of that route type, so these tiers
+    are used with ``density_tiers(..., inclusive=True)``.
+
+    Returns:
+        thresholds: sorted distinct activity units per acre thresholds
+
+        labels: one label per tier, e.g. ``'< 7'``, ``'7 to < 15'``, ``'>= 40'``
+    """
+    thresholds = sorted(set(config['transit_supportive_density'].values()))
+    labels = ([f"< {thresholds[0]}"]
+              + [f"{low} to < {high}" for low, high in zip(thresholds, thresholds[1:])]
+              + [f">= {thresholds[-1]}"])
+    return thresholds, labels
+
+
+def signals_in_hexes(signals, hexes):
+    """
+    Attach the attributes of the containing hex to every signal.
+
+    Each signal's hex is found with one ``within`` STRtree query over the
+    hex grid rather than a spatial join, and the hex attributes are then
+    taken by position. As with ``sjoin(how='inner', predicate='within')``,
+    signals outside the grid or on the edge between hexes are dropped.
+
+    Args:
+        signals: ITS signals
+        hexes: activity unit hex grid
+
+    Returns:
+        GeoDataFrame of signals with ``index_right`` and the hex attributes
+    """
+    signal_idx, hex_idx = shapely.STRtree(hexes.geometry.values).query(
+        signals.geometry.values, predicate='within')
+    order = np.lexsort((hex_idx, signal_idx))
+    signal_idx, matched = signal_idx[order], hex_idx[order]
+
+    hex_attributes = hexes.drop(columns=hexes.geometry.name).iloc[matched]
+    # column names follow GeoDataFrame.sjoin
+    shared = signals.columns.intersection(hex_attributes.columns)
+    gdf = signals.iloc[signal_idx].rename(columns={col: f"{col}_left" for col in shared})
+    gdf['index_right'] = hex_attributes.index.to_numpy()
+    for col in hex_attributes.columns:
+        name = f"{col}_right" if col in shared else col
+        gdf[name] = hex_attributes[col].to_numpy()
+    return gdf
+
 
 def run(config):
     """
     Create a layer of signals with accessible pedestrian signals 
-    that are within high-density activity unit hex's (defined as activity units per acre > 25)
+    that are within high-density activity unit hex's (defined as activity units per acre > 25,
+    see ``DENSITY_THRESHOLDS``)
     
     Output: 
 
@@ -17,6 +101,10 @@ def run(config):
         A crosstab summary table in CSV form, showing the counts of signals
             by accessible pedestrian signal status by density status
 
+        A long summary table 'signal_density_summary.csv' counting the signals
+            of every value of each ``signal_summary_attributes`` column by
+            ``transit_supportive_density`` tier and county
+
     """
 
     try:
@@ -28,13 +116,9 @@ def run(config):
         au_2050 = utils.get_onedrive_layer(
             config, 'activity_units_path', 'peope_and_jobs_2050'
         )
-        au_2050['is_dense'] = au_2050['au_acre'].apply(
-            lambda x: 'high density' if x > 25 else 'low density'
-        )
+        au_2050['is_dense'] = density_tiers(au_2050['au_acre'])
 
-        ped_signals_with_density = signals.sjoin(
-            au_2050, how='inner', predicate='within'
-        )
+        ped_signals_with_density = signals_in_hexes(signals, au_2050)
 
         gdf = ped_signals_with_density.drop('OBJECTID', axis=1)
         x_tab = pd.crosstab(gdf['ped_signal'], gdf['is_dense'])
@@ -43,6 +127,15 @@ def run(config):
             x_tab, config, 'density_and_signals.csv', index=True
         )
 
+        thresholds, labels = supportive_density_tiers(config)
+        tiers = pd.Categorical(density_tiers(gdf['au_acre'], thresholds, labels, inclusive=True),
+                               categories=labels)
+        summary = crosstab.attribute_counts(
+            gdf.assign(density_tier=tiers), config['signal_summary_attributes'],
+            by=['density_tier', 'county']
+        )
+        utils.export_csv(summary, config, 'signal_density_summary.csv')
+
         utils.export_layer(
             gdf, config, lyr_nm='accessible_ped_signals_in_dense_areas'
         )
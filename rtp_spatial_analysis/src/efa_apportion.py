@@ -0,0 +1,108 @@
+"""
+Tract-level apportioning of population to Equity Focus Areas (EFAs).
+
+The EFA table gives, for every 2020 tract, the share of its population in
+each equity focus area (the ``*_prct_est`` columns). Rather than multiplying
+those shares onto every parcel, parcel population is first summed by tract
+for each group of interest (inside a buffer, a route type, the whole region)
+and the shares are applied to the tract totals:
+
+    efa_pop[group, county] = sum over tracts in county of tract_pop[tract, group] * pct[tract]
+
+Memory and time then scale with the number of tracts rather than with
+parcels x EFA categories, and partial tract sums from parcel chunks simply
+add up.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+class EfaApportioner:
+    """
+    Apportion parcel population to EFAs through tract shares.
+
+    Args:
+        efa (pandas.DataFrame): EFA table with ``geoid20`` and the
+            ``*_prct_est`` share columns.
+        tract_county (pandas.Series): County of each tract, indexed by
+            ``geoid20``. Its name is used as the county level name of results.
+    """
+
+    def __init__(self, efa, tract_county):
+        efa = efa.drop_duplicates('geoid20')
+        self.pct_cols = list(efa.columns[efa.columns.str.endswith('prct_est')])
+        self.geoids = pd.Index(efa['geoid20'])
+        self.pct = efa[self.pct_cols].fillna(0).to_numpy(dtype=float)
+        county = tract_county[~tract_county.index.duplicated()].reindex(self.geoids)
+        self.county_name = tract_county.name
+        self.county_codes, self.counties = pd.factorize(county, sort=True)
+
+    @property
+    def n_tracts(self):
+        """Number of tracts in the EFA table."""
+        return len(self.geoids)
+
+    def tract_index(self, geoid20):
+        """
+        Position of each parcel's tract in the EFA table.
+
+        Args:
+            geoid20 (array-like): Tract id of each parcel.
+
+        Returns:
+            numpy.ndarray: Tract positions, -1 where the tract is missing from
+                the EFA table (those parcels are left out, as with an inner merge).
+        """
+        return self.geoids.get_indexer(pd.Index(geoid20))
+
+    def tract_sums(self, tract_idx, weights):
+        """
+        Sum parcel population weights by tract.
+
+        Args:
+            tract_idx (numpy.ndarray): Output of :meth:`tract_index`.
+            weights (pandas.DataFrame): One row per parcel, one column per
+                group, holding the population each parcel contributes to the
+                group (e.g. population x served share).
+
+        Returns:
+            pandas.DataFrame: Tracts x groups. Sums from parcel chunks can be
+                added together.
+        """
+        ok = tract_idx >= 0
+        values = weights.to_numpy(dtype=float)[ok]
+        sums = np.column_stack([
+            np.bincount(tract_idx[ok], weights=values[:, g], minlength=self.n_tracts)
+            for g in range(values.shape[1])
+        ]) if values.shape[1] else np.zeros((self.n_tracts, 0))
+        return pd.DataFrame(sums, index=self.geoids, columns=weights.columns)
+
+    def apportion(self, tract_sums):
+        """
+        EFA population of every group by county.
+
+        Args:
+            tract_sums (pandas.DataFrame): Output of :meth:`tract_sums`.
+
+        Returns:
+            pandas.DataFrame: One row per group x county (the group column
+                levels followed by the county level), one column per
+                ``*_prct_est`` share column.
+        """
+        onehot = np.zeros((len(self.counties), self.n_tracts))
+        has_county = self.county_codes >= 0
+        onehot[self.county_codes[has_county], np.flatnonzero(has_county)] = 1.0
+
+        pop = tract_sums.to_numpy(dtype=float)
+        # groups x counties x efa categories
+        result = np.einsum('ct,tg,te->gce', onehot, pop, self.pct)
+
+        groups = tract_sums.columns
+        group_tuples = list(groups) if isinstance(groups, pd.MultiIndex) else [(g,) for g in groups]
+        group_names = list(groups.names) if groups.nlevels > 1 else [groups.name]
+        index = pd.MultiIndex.from_tuples(
+            [(*g, c) for g in group_tuples for c in self.counties],
+            names=group_names + [self.county_name],
+        )
+        return pd.DataFrame(result.reshape(-1, len(self.pct_cols)), index=index, columns=self.pct_cols)
@@ -0,0 +1,158 @@
+"""
+Local mirror of the ElmerGeo layers used by the analyses.
+
+Layers are fetched from ElmerGeo once, reprojected to ``config['epsg_crs']``
+and kept as snapshots (GeoParquet, or GeoPackage without pyarrow) under
+``elmergeo_snapshot_dir`` (default ``cache_dir/elmergeo``). Later runs read
+the snapshot and never touch the database, so the pipeline also runs on
+machines without ElmerGeo access; with ``elmergeo_offline: true`` a missing
+snapshot is an error instead of a database read.
+
+All reads in a process share one ElmerGeo connection. Snapshots are not
+invalidated automatically; refresh them when ElmerGeo changes with::
+
+    python -m rtp_spatial_analysis.src.elmergeo [LAYER ...] [-c CONFIGS_DIR]
+"""
+
+import argparse
+import os
+from pathlib import Path
+
+import geopandas as gpd
+
+from . import configuration
+from . import layer_cache
+from . import utils
+
+# layers read by the analyses; refreshed when no layer is named
+LAYERS = ['cities', 'TRACT2020']
+
+_conn = None
+_layers = {}
+
+
+def get_connection():
+    """
+    Return the process-wide ElmerGeo connection, opening it on first use.
+
+    psrcelmerpy is imported here so that runs served from snapshots do not
+    need it installed.
+    """
+    global _conn
+    if _conn is None:
+        import psrcelmerpy
+        _conn = psrcelmerpy.ElmerGeoConn()
+    return _conn
+
+
+def snapshot_path(config, layer):
+    """
+    Path of the local snapshot of an ElmerGeo layer.
+
+    Args:
+        config (dict): Configuration dictionary. ``elmergeo_snapshot_dir``
+            overrides the default ``cache_dir/elmergeo``.
+        layer (str): ElmerGeo layer name.
+
+    Returns:
+        pathlib.Path: The snapshot file (may not exist).
+    """
+    snapshot_dir = config.get('elmergeo_snapshot_dir')
+    root = Path(snapshot_dir).expanduser() if snapshot_dir else layer_cache.cache_root(config) / 'elmergeo'
+    suffix = '.parquet' if layer_cache.parquet_available() else '.gpkg'
+    return root / f"{layer}{suffix}"
+
+
+def refresh_layer(config, layer):
+    """
+    Fetch a layer from ElmerGeo and overwrite its snapshot.
+
+    Args:
+        config (dict): Configuration dictionary.
+        layer (str): ElmerGeo layer name.
+
+    Returns:
+        geopandas.GeoDataFrame: The layer in ``config['epsg_crs']``.
+    """
+    gdf = get_connection().read_geolayer(layer, project_to_wgs84=False)
+    return save_snapshot(config, layer, gdf)
+
+
+def save_snapshot(config, layer, gdf):
+    """
+    Write a layer as the snapshot of an ElmerGeo layer.
+
+    Used by :func:`refresh_layer`, and by the benchmark fixtures to stand in
+    for ElmerGeo.
+
+    Args:
+        config (dict): Configuration dictionary.
+        layer (str): ElmerGeo layer name.
+        gdf (geopandas.GeoDataFrame): The layer, in any CRS.
+
+    Returns:
+        geopandas.GeoDataFrame: The layer in ``config['epsg_crs']``.
+    """
+    gdf = gdf.to_crs(config['epsg_crs'])
+
+    path = snapshot_path(config, layer)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"tmp_{path.name}")
+    if path.suffix == '.parquet':
+        gdf.to_parquet(tmp_path)
+    else:
+        utils.write_layer(config, gdf, tmp_path, driver='GPKG')
+    os.replace(tmp_path, path)
+    _layers[layer] = gdf
+    return gdf
+
+
+def get_layer(config, layer, columns=None):
+    """
+    Return an ElmerGeo layer, from its snapshot when there is one.
+
+    Args:
+        config (dict): Configuration dictionary. With ``elmergeo_offline``
+            set, the database is never contacted.
+        layer (str): ElmerGeo layer name, e.g. ``TRACT2020`` or ``cities``.
+        columns (list, optional): Columns to return, geometry included.
+            Defaults to None (all columns).
+
+    Returns:
+        geopandas.GeoDataFrame: A copy of the layer in ``config['epsg_crs']``.
+
+    Raises:
+        FileNotFoundError: If offline and the layer has no snapshot.
+    """
+    if layer not in _layers:
+        path = snapshot_path(config, layer)
+        if path.exists():
+            gdf = gpd.read_parquet(path) if path.suffix == '.parquet' else utils.read_layer(config, path)
+            _layers[layer] = gdf.to_crs(config['epsg_crs'])
+        elif config.get('elmergeo_offline', False):
+            raise FileNotFoundError(
+                f"No ElmerGeo snapshot of {layer} at {path}; refresh it with "
+                f"python -m rtp_spatial_analysis.src.elmergeo {layer}")
+        else:
+            refresh_layer(config, layer)
+
+    gdf = _layers[layer]
+    if columns is not None:
+        gdf = gdf[list(columns)]
+    return gdf.copy()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Refresh local ElmerGeo snapshots")
+    configuration.add_run_args(parser)
+    parser.add_argument('layers', nargs='*', default=LAYERS, help='ElmerGeo layers to refresh')
+    args = parser.parse_args()
+
+    config = configuration.load_config(args.configs_dir)
+    for layer in args.layers:
+        gdf = refresh_layer(config, layer)
+        print(f"{layer}: {len(gdf)} features -> {snapshot_path(config, layer)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""
+Buffered writer for the output geodatabase.
+
+During a scheduled run, :func:`utils.export_layer` does not open
+``future_system_output.gdb`` itself. It hands the layer to the active
+:class:`ExportSink`, which keeps the last version of every layer name. Each
+step returns its layers to the parent process, and the parent writes them
+all in one batch once the run is over.
+
+Only the collected layers are written, each replacing its previous version
+in place; the files of the other layers in the geodatabase are left
+untouched, so OneDrive only syncs the layers that changed (and the
+geodatabase's catalog tables). Steps that fail never write anything: their
+layers are discarded, so an interrupted step cannot leave a half-written
+layer behind.
+
+With ``export_geoparquet: true`` every layer is also written as GeoParquet
+to ``<gdb name>_parquet`` next to the geodatabase, for fast downstream reads.
+"""
+
+import os
+from contextlib import contextmanager
+from pathlib import Path
+
+from . import layer_cache
+from . import utils
+
+_active = None
+
+
+class ExportSink:
+    """
+    Layers exported during a run, keyed by layer name.
+
+    A layer exported several times is written once, in its last version.
+    """
+
+    def __init__(self):
+        self.layers = {}
+
+    def add(self, lyr_nm, gdf):
+        """Collect a layer for the output geodatabase."""
+        self.layers[lyr_nm] = gdf
+
+    def update(self, layers):
+        """Collect the layers returned by a step."""
+        self.layers.update(layers)
+
+    def flush(self, config):
+        """
+        Write the collected layers to the output geodatabase in one batch.
+
+        Each layer replaces its previous version in the geodatabase; other
+        layers are not rewritten.
+
+        Args:
+            config (dict): Configuration dictionary with ``user_onedrive``,
+                ``rtp_output_path`` and ``rtp_output_gdb_name``.
+        """
+        if not self.layers:
+            return
+        output_dir = Path(f"{config['user_onedrive']}/{config['rtp_output_path']}")
+        target = output_dir / config['rtp_output_gdb_name']
+
+        output_dir.mkdir(parents=True, exist_ok=True)
+        for lyr_nm, gdf in self.layers.items():
+            utils.write_layer(config, gdf, target, layer=lyr_nm)
+
+        if config.get('export_geoparquet', False):
+            if layer_cache.parquet_available():
+                parquet_dir = output_dir / f"{target.stem}_parquet"
+                parquet_dir.mkdir(parents=True, exist_ok=True)
+                for lyr_nm, gdf in self.layers.items():
+                    path = parquet_dir / Path(lyr_nm).with_suffix('.parquet').name
+                    tmp_path = path.with_name(f"tmp_{path.name}")
+                    gdf.to_parquet(tmp_path)
+                    os.replace(tmp_path, path)
+            else:
+                print("export_geoparquet needs pyarrow; GeoParquet copies not written")
+
+        print(f"Wrote {len(self.layers)} layers to {target}")
+        self.layers = {}
+
+
+def active():
+    """Return the sink collecting exports in this process, or None."""
+    return _active
+
+
+@contextmanager
+def collect():
+    """
+    Collect the layers exported within the ``with`` block.
+
+    Yields:
+        ExportSink: The sink receiving :func:`utils.export_layer` calls.
+    """
+    global _active
+    previous, _active = _active, ExportSink()
+    try:
+        yield _active
+    finally:
+        _active = previous
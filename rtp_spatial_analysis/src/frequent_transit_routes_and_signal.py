@@ -1,6 +1,4 @@
-import geopandas as gpd
-import psrcelmerpy
-from pathlib import Path
+from . import crosstab
 from . import utils
 import pandas as pd
 
@@ -15,19 +13,11 @@ def combine_layers(line_layer, hex_layer):
 def run(config):
     """retrieve fgts and activity units layers, and process them"""
 
-    eg_conn = psrcelmerpy.ElmerGeoConn()
-    cities = eg_conn.read_geolayer("cities")
-    cities = cities.to_crs(2285)
-
     # opening frequent transit routes layer #
-    transit_path = f"{config['user_onedrive']}/{config['rtp_transit_data_path']}"
-    transit_routes = gpd.read_file(
-        Path(transit_path) / "Transit_Network_2050_Scenario2b.gdb",
-        layer="transit_routes_2050",
-        engine="fiona",
+    transit_routes = utils.get_onedrive_layer(
+        config, "rtp_transit_network_path", "transit_routes_2050"
     )
     transit_routes_frequent = transit_routes[transit_routes["frequent"] == 1]
-    transit_routes_frequent = transit_routes_frequent.to_crs(2285)
     print(transit_routes_frequent)
     print("transit routes done")
 
@@ -35,30 +25,20 @@ def run(config):
     # print(layers)
 
     # opening its signals layer #
-    signals_path = f"{config['user_onedrive']}/{config['rtp_its_signals_path']}"
-    signals = gpd.read_file(
-        Path(signals_path) / "ITS_Signals_2024_Final.gdb",
-        layer="ITS_Signals",
-        engine="fiona",
-    )
-    signals = signals.to_crs(2285)
-    signals.geometry = signals.geometry.buffer(100)
+    signals = utils.get_onedrive_layer(config, "its_signals_path", "its_signals")
     print(signals)
     print("signals done")
 
-    # combining frequent transit routes and signals #
-    signals_on_routes = gpd.sjoin(
-        signals, transit_routes_frequent, how="inner", predicate="intersects"
-    )
-    signals_on_routes = signals_on_routes.drop_duplicates(subset=signals.columns)
-
-    num_yes_tsp = (signals_on_routes["tsp"] == "Yes").sum()
-    num_no_tsp = (signals_on_routes["tsp"] == "No").sum()
-    count_rows(num_yes_tsp, num_no_tsp, "tsp_counts.csv", config)
+    # combining frequent transit routes and signals: signals within 100 feet
+    # of a frequent route, with the nearest one #
+    signals_on_routes = utils.match_points_to_lines(signals, transit_routes_frequent, 100)
 
-    num_yes_ped = (signals_on_routes["ped_signal"] == "Yes").sum()
-    num_no_ped = (signals_on_routes["ped_signal"] == "No").sum()
-    count_rows(num_yes_ped, num_no_ped, "ped_signal_counts.csv", config)
+    # yes/no counts of both attributes in one pass #
+    counts = crosstab.attribute_counts(signals_on_routes, ["tsp", "ped_signal"])
+    counts = counts.set_index(["attribute", "value"])["count"]
+    for attribute in ["tsp", "ped_signal"]:
+        count_rows(counts.get((attribute, "Yes"), 0), counts.get((attribute, "No"), 0),
+                   f"{attribute}_counts.csv", config)
 
     utils.export_layer(
         signals_on_routes, config, "frequent_transit_routes_and_signal.shp"
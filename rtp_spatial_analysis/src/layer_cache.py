@@ -0,0 +1,277 @@
+"""
+Process-wide cache for layers read through :func:`utils.get_onedrive_layer`.
+
+A single ``run.main()`` asks for the same OneDrive layers several times
+(``peope_and_jobs_2050`` from four analyses, the parcel layer from two).
+The cache keeps reprojected copies of those layers so that each one is read
+from the file geodatabase only once per run:
+
+* a memory tier, bounded by ``layer_cache_memory_mb`` and evicted in
+  least-recently-used order
+* an optional disk tier that stores each reprojected layer as GeoParquet
+  under ``cache_dir`` so that reruns skip the file geodatabase entirely
+
+Entries are keyed by a hash of (path, layer, CRS, column subset) together
+with the size and modification time of the source, so an edited source
+layer is never served from a stale copy.
+"""
+
+import hashlib
+import importlib.util
+import os
+from collections import OrderedDict
+from pathlib import Path
+
+import geopandas as gpd
+import pandas as pd
+import shapely
+
+DEFAULT_MEMORY_MB = 4096
+DEFAULT_CACHE_DIR = Path.home() / ".rtp_spatial_analysis" / "cache"
+
+_cache = None
+
+
+def source_signature(path):
+    """
+    Return a cheap signature of a source file or directory.
+
+    File geodatabases are directories, so the signature combines the total
+    size and the latest modification time of every file below ``path``.
+
+    Args:
+        path (str or pathlib.Path): Path to a file or directory.
+
+    Returns:
+        tuple: ``(total_size_in_bytes, latest_mtime_ns)``. ``(0, 0)`` if the
+            path does not exist.
+    """
+    path = Path(path)
+    if not path.exists():
+        return (0, 0)
+    if path.is_file():
+        stat = path.stat()
+        return (stat.st_size, stat.st_mtime_ns)
+
+    size, mtime = 0, path.stat().st_mtime_ns
+    for root, _, files in os.walk(path):
+        for name in files:
+            stat = os.stat(os.path.join(root, name))
+            size += stat.st_size
+            mtime = max(mtime, stat.st_mtime_ns)
+    return (size, mtime)
+
+
+def fingerprint(*parts):
+    """
+    Hash an arbitrary sequence of values into a short hex digest.
+
+    Args:
+        *parts: Values whose ``repr`` identifies the cached object.
+
+    Returns:
+        str: A 20 character SHA-1 hex digest.
+    """
+    return hashlib.sha1(repr(parts).encode("utf-8")).hexdigest()[:20]
+
+
+def frame_signature(gdf):
+    """
+    Hash the contents of a (Geo)DataFrame.
+
+    Used for layers that have no file to stat, such as layers read from a
+    database. Attribute values are hashed with pandas and geometries by
+    their WKB.
+
+    Args:
+        gdf (pandas.DataFrame or geopandas.GeoDataFrame): The frame to hash.
+
+    Returns:
+        str: A 20 character SHA-1 hex digest.
+    """
+    digest = hashlib.sha1()
+    attributes = gdf
+    if isinstance(gdf, gpd.GeoDataFrame):
+        attributes = gdf.drop(columns=gdf.geometry.name)
+        for wkb in shapely.to_wkb(gdf.geometry.values):
+            digest.update(wkb or b"")
+    digest.update(repr(list(attributes.columns)).encode("utf-8"))
+    digest.update(pd.util.hash_pandas_object(attributes, index=False).to_numpy().tobytes())
+    return digest.hexdigest()[:20]
+
+
+def cache_root(config):
+    """
+    Return the local directory used for on-disk caches.
+
+    Args:
+        config (dict): Configuration dictionary. ``cache_dir`` overrides
+            the default location (``~/.rtp_spatial_analysis/cache``).
+
+    Returns:
+        pathlib.Path: The cache directory (not created).
+    """
+    cache_dir = config.get("cache_dir")
+    return Path(cache_dir).expanduser() if cache_dir else DEFAULT_CACHE_DIR
+
+
+def parquet_available():
+    """Return True if pyarrow is installed, which GeoParquet requires."""
+    return importlib.util.find_spec("pyarrow") is not None
+
+
+def estimate_nbytes(gdf):
+    """
+    Estimate the memory held by a GeoDataFrame.
+
+    ``memory_usage`` only counts the geometry column's object pointers, so
+    16 bytes per coordinate are added for the geometries themselves.
+
+    Args:
+        gdf (geopandas.GeoDataFrame): The frame to measure.
+
+    Returns:
+        int: Approximate size in bytes.
+    """
+    nbytes = int(gdf.memory_usage(deep=True, index=True).sum())
+    if isinstance(gdf, gpd.GeoDataFrame) and gdf.geometry.name in gdf:
+        nbytes += 16 * int(shapely.get_num_coordinates(gdf.geometry.values).sum())
+    return nbytes
+
+
+class LayerCache:
+    """
+    Two-tier (memory + GeoParquet) cache of reprojected layers.
+
+    Args:
+        memory_budget_mb (float): Memory budget of the in-memory tier.
+            Least recently used layers are evicted once it is exceeded.
+        cache_dir (pathlib.Path, optional): Directory of the disk tier. The
+            disk tier is disabled when None or when pyarrow is unavailable.
+    """
+
+    def __init__(self, memory_budget_mb=DEFAULT_MEMORY_MB, cache_dir=None):
+        self.memory_budget = int(memory_budget_mb * 1024 * 1024)
+        self.cache_dir = Path(cache_dir) if cache_dir and parquet_available() else None
+        self._entries = OrderedDict()
+        self._nbytes = {}
+
+    @property
+    def memory_used(self):
+        """Bytes currently held by the memory tier."""
+        return sum(self._nbytes.values())
+
+    def key(self, path, layer, crs, columns=None, **options):
+        """
+        Build the content-hashed cache key of a layer.
+
+        Args:
+            path (str or pathlib.Path): Path to the source dataset.
+            layer (str): Layer name within the dataset.
+            crs (int or str): Target CRS of the cached copy.
+            columns (list, optional): Column subset, None for all columns.
+            **options: Any other reader options that change the result.
+
+        Returns:
+            str: Hex digest identifying this version of the layer.
+        """
+        cols = tuple(columns) if columns is not None else None
+        return fingerprint(str(path), layer, str(crs), cols,
+                           sorted(options.items()), source_signature(path))
+
+    def get(self, key):
+        """
+        Return a copy of the cached layer, or None on a miss.
+
+        A disk hit is promoted into the memory tier.
+        """
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return self._entries[key].copy()
+
+        disk_path = self._disk_path(key)
+        if disk_path is not None and disk_path.exists():
+            gdf = gpd.read_parquet(disk_path)
+            self._remember(key, gdf)
+            return gdf.copy()
+        return None
+
+    def put(self, key, gdf):
+        """Store a layer in the memory tier and, if enabled, on disk."""
+        disk_path = self._disk_path(key)
+        if disk_path is not None and not disk_path.exists():
+            disk_path.parent.mkdir(parents=True, exist_ok=True)
+            # a temp name per process, so concurrent writers of a key never share one
+            tmp_path = disk_path.with_name(f"{disk_path.stem}.{os.getpid()}.tmp")
+            gdf.to_parquet(tmp_path)
+            try:
+                os.replace(tmp_path, disk_path)
+            except OSError:
+                # another process put the same layer first (Windows cannot
+                # replace a file that is being read)
+                tmp_path.unlink(missing_ok=True)
+                if not disk_path.exists():
+                    raise
+        self._remember(key, gdf)
+
+    def get_or_load(self, key, loader):
+        """
+        Return the cached layer for ``key``, calling ``loader()`` on a miss.
+
+        Args:
+            key (str): Key from :meth:`key`.
+            loader (callable): Zero-argument function returning the layer.
+
+        Returns:
+            geopandas.GeoDataFrame: A copy the caller is free to modify.
+        """
+        gdf = self.get(key)
+        if gdf is None:
+            gdf = loader()
+            self.put(key, gdf)
+            gdf = gdf.copy()
+        return gdf
+
+    def clear(self):
+        """Empty the memory tier. Files in the disk tier are kept."""
+        self._entries.clear()
+        self._nbytes.clear()
+
+    def _disk_path(self, key):
+        if self.cache_dir is None:
+            return None
+        return self.cache_dir / f"{key}.parquet"
+
+    def _remember(self, key, gdf):
+        nbytes = estimate_nbytes(gdf)
+        if nbytes > self.memory_budget:
+            return
+        self._entries[key] = gdf
+        self._entries.move_to_end(key)
+        self._nbytes[key] = nbytes
+        while self.memory_used > self.memory_budget:
+            old_key, _ = self._entries.popitem(last=False)
+            del self._nbytes[old_key]
+
+
+def get_cache(config):
+    """
+    Return the process-wide :class:`LayerCache`, creating it on first use.
+
+    Args:
+        config (dict): Configuration dictionary. Reads
+            ``layer_cache_memory_mb``, ``use_disk_cache`` and ``cache_dir``.
+
+    Returns:
+        LayerCache: The shared cache instance.
+    """
+    global _cache
+    if _cache is None:
+        cache_dir = None
+        if config.get("use_disk_cache", True):
+            cache_dir = cache_root(config) / "layers"
+        _cache = LayerCache(
+            memory_budget_mb=config.get("layer_cache_memory_mb", DEFAULT_MEMORY_MB),
+            cache_dir=cache_dir,
+        )
+    return _cache
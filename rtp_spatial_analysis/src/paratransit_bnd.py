@@ -1,14 +1,22 @@
+from . import efa_apportion
+from . import layer_cache
+from . import parcel_tract
+from . import summary_table
 from . import utils
 import os
+import numpy as np
 import pandas as pd
 import geopandas as gpd
-import psrcelmerpy
+import shapely
 from pathlib import Path 
 
 pd.set_option('display.max_columns', None)
 pd.set_option('display.float_format', lambda x: '%.9f' % x)
 
-def buffer_transit_routes(config):
+# paratransit boundary: buffer distance around the routes, in miles
+BUFFER_MILES = 0.75
+
+def get_paratransit_routes(config):
     """
     Remove Sounder, ST Express, and Ferries from transit routes:
         Sounder -> route_type==2 and agency==6.
@@ -18,70 +26,185 @@ def buffer_transit_routes(config):
     """
     print('Read transit routes')
     trs = utils.get_onedrive_layer(config, 'rtp_transit_network_path', 'transit_routes_2050')
-    trs_filtered = trs[~((trs['route_type'].isin([2, 3])) & (trs['agency_id'] == "6") | (trs['route_type'] == 4))]
+    return(trs[~((trs['route_type'].isin([2, 3])) & (trs['agency_id'] == "6") | (trs['route_type'] == 4))])
+
+def buffer_transit_routes(config):
+    """
+    Buffer the paratransit routes (:func:`get_paratransit_routes`) by 3/4 mile
+    and dissolve the buffers. The dissolve is tiled by ``dissolve_tile_ft``
+    and runs the tiles in up to ``scheduler_workers`` processes (see
+    :func:`utils.dissolve_geometries`).
+
+    """
+    trs_filtered = get_paratransit_routes(config)
  
     # buffer transit routes
-    trs_buff = utils.buffer_layer(layer_gdf = trs_filtered, distance = config['mile_in_ft']*.75)
-    trs_buff = trs_buff[['route_id', 'geometry']]
-    trs_buff = trs_buff.dissolve()
-    trs_buff.loc[trs_buff['route_id'].notna(), 'route_id'] = 'Inside Buffered TRS'
-    return(trs_buff)
+    trs_buff = utils.buffer_layer(layer_gdf = trs_filtered, distance = config['mile_in_ft']*BUFFER_MILES)
+    boundary = utils.dissolve_geometries(trs_buff.geometry.values,
+                                         tile_size=config.get('dissolve_tile_ft', 0),
+                                         workers=int(config.get('scheduler_workers', 1)))
+    return(gpd.GeoDataFrame({'route_id': ['Inside Buffered TRS']}, geometry=[boundary], crs=trs_filtered.crs))
 
-def create_parcel_overlay(config):
+def get_buffered_routes(config):
     """
-    Overlay of parcelized activity units, tracts, and buffered transit routes. 
+    Dissolved buffered transit routes, built once per transit network and buffer distance.
 
-    Remove Sounder, ST Express, and Ferries from transit routes:
-        Sounder -> route_type==2 and agency==6.
-        ST Express -> route_type==3 and agency ==6.
-        Ferries -> route_type == 4.    
+    The boundary is stored under ``cache_dir/paratransit`` (GeoParquet, or
+    GeoPackage without pyarrow) and keyed by a hash of the transit network
+    geodatabase's signature and the buffer distance, so a new network or
+    distance rebuilds it.
+
+    Returns:
+     GeoDataFrame with one 'Inside Buffered TRS' row, see :func:`buffer_transit_routes`.
 
     """
+    network = Path(f"{config['user_onedrive']}/{config['rtp_transit_network_path']}")
+    key = layer_cache.fingerprint(str(network), 'transit_routes_2050', layer_cache.source_signature(network),
+                                  config['mile_in_ft']*BUFFER_MILES, str(config['epsg_crs']))
+    suffix = '.parquet' if layer_cache.parquet_available() else '.gpkg'
+    path = layer_cache.cache_root(config) / 'paratransit' / f"{key}{suffix}"
+    if path.exists():
+        return gpd.read_parquet(path) if suffix == '.parquet' else utils.read_layer(config, path)
 
     trs_buff = buffer_transit_routes(config)
+    if config.get('use_disk_cache', True):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # per-process temp name, so a concurrent or interrupted build never leaves a partial boundary
+        tmp_path = path.with_name(f"{path.stem}.{os.getpid()}.tmp{suffix}")
+        if suffix == '.parquet':
+            trs_buff.to_parquet(tmp_path)
+        else:
+            utils.write_layer(config, trs_buff, tmp_path, driver='GPKG')
+        os.replace(tmp_path, path)
+    return(trs_buff)
 
-    # read activity units layer
-    print('Read AU')
-    au_columns = ['population_2050', "geometry"]
-    au = utils.get_onedrive_layer(config, 'au_path', 'draft_parcel_data_rtp_2026')
-    au = au[au_columns]
-
-    # overlay with CT 2020
-    tract_columns = ["population_2050", "geoid20", "countyfp", "county_name", "tractce20", "geometry"]
-    eg_conn = psrcelmerpy.ElmerGeoConn()
-    tract = eg_conn.read_geolayer('TRACT2020')
-    tract = tract.to_crs(2285)
-    au_tract = gpd.sjoin(au, tract, how="left")
-    au_tract = au_tract[tract_columns]
+def create_parcel_overlay(au, lookup, trs_buff):
+    """
+    Overlay of parcelized activity units, tracts, and buffered transit routes. 
+
+    Works on any subset of the parcel layer, so it can be applied chunk by chunk.
+
+    Args:
+     au: parcels with parcel_id, population_2050 and geometry.
+     lookup: parcel -> tract lookup from :func:`parcel_tract.get_lookup`.
+     trs_buff: dissolved buffered transit routes from :func:`get_buffered_routes`.
+
+    """
+
+    # tract and county of each parcel, including the nearest tract for
+    # parcels outside every tract
+    au_tract = parcel_tract.join_tracts(au, lookup)
+    au_tract = au_tract[["population_2050", "geoid20", "countyfp", "geometry"]]
 
     # overlay with buffered transit routes
     au_tract_trs = gpd.sjoin(au_tract, trs_buff, how="left")
-
-    # clean up au_tract_trs, one parcel missing tract information
     au_tract_trs['route_id'] = au_tract_trs['route_id'].fillna("Outside Buffered TRS")
-    missing_tract = au_tract_trs[au_tract_trs['countyfp'].isnull() & au_tract_trs['population_2050'] > 0]
-    missing_tract = missing_tract.drop(['index_right'], axis=1)
-    missing_tract_join = gpd.sjoin_nearest(missing_tract, tract[['countyfp', 'geoid20', 'geometry']], how="left")
-    missing_tract_join = missing_tract_join[['countyfp_right', 'geoid20_right']]
-    missing_tract_join.rename(columns={'countyfp_right': 'countyfp', 'geoid20_right':'geoid20'}, inplace=True)
-
-    au_tract_trs.update(missing_tract_join) # update missing info from missing tract table
 
     return(au_tract_trs)
 
+def classify_parcels(au, routes, distance):
+    """
+    Parcels within a distance of the routes, decided from representative points where possible.
+
+    The distance from each parcel's representative point to the nearest route
+    comes from one STRtree ``query_nearest``. A parcel whose point is within
+    ``distance`` is inside; a parcel whose point is farther than ``distance``
+    plus the parcel's radius around that point (its farthest vertex) is
+    outside. Only the parcels in between, which straddle the boundary, get an
+    exact ``dwithin`` test of the parcel polygon against the routes. The
+    buffered routes are never built.
+
+    Args:
+     au: parcels with geometry.
+     routes: paratransit routes from :func:`get_paratransit_routes`.
+     distance: boundary distance around the routes, in feet.
+
+    Returns:
+     inside: boolean array aligned with au.
+
+     n_exact: number of parcels that needed the exact check.
+
+    """
+    geoms = au.geometry.values
+    points = shapely.point_on_surface(geoms)
+    tree = shapely.STRtree(routes.geometry.values)
+    (point_idx, _), dist = tree.query_nearest(points, return_distance=True, all_matches=False)
+    nearest = np.full(len(geoms), np.inf)
+    nearest[point_idx] = dist
+
+    inside = nearest <= distance
+    radius = shapely.hausdorff_distance(points, geoms)
+    straddle = np.flatnonzero(~inside & (nearest <= distance + radius))
+    hit, _ = tree.query(geoms[straddle], predicate='dwithin', distance=distance)
+    inside[straddle[np.unique(hit)]] = True
+    return(inside, len(straddle))
+
+def create_parcel_points(au, lookup, routes, distance):
+    """
+    Same table as :func:`create_parcel_overlay`, classified with :func:`classify_parcels`.
+
+    Returns:
+     au_tract_trs: parcels with population_2050, geoid20, countyfp and route_id.
+
+     n_exact: number of parcels that needed the exact check.
+
+    """
+    au_tract = parcel_tract.join_tracts(au, lookup)
+    au_tract_trs = au_tract[["population_2050", "geoid20", "countyfp", "geometry"]].copy()
+    inside, n_exact = classify_parcels(au_tract_trs, routes, distance)
+    au_tract_trs['route_id'] = np.where(inside, "Inside Buffered TRS", "Outside Buffered TRS")
+    return(au_tract_trs, n_exact)
+
+def sum_tract_population(config, trs_buff, lookup, routes=None):
+    """
+    Population 2050 by tract, county and inside/outside the buffered transit routes.
+
+    Parcels are read in chunks (``parcel_chunk_size``); each chunk is overlaid
+    and summed on its own and the partial sums are combined.
+
+    With ``paratransit_classification: points`` parcels are classified by
+    :func:`classify_parcels` instead of the overlay, and the number of
+    parcels decided by their representative point and by the exact check is
+    printed.
+
+    Args:
+     trs_buff: dissolved buffered transit routes from :func:`get_buffered_routes`.
+     lookup: parcel -> tract lookup from :func:`parcel_tract.get_lookup`.
+     routes: paratransit routes from :func:`get_paratransit_routes`, used by
+      the ``points`` classification.
+
+    """
+    how = config.get('paratransit_classification', 'overlay')
+    distance = config['mile_in_ft']*BUFFER_MILES
+    print('Read AU')
+    parts = []
+    n_parcels, n_exact = 0, 0
+    for au in utils.iter_parcels(config):
+        if how == 'points':
+            au_tract_trs, chunk_exact = create_parcel_points(au, lookup, routes, distance)
+            n_parcels += len(au_tract_trs)
+            n_exact += chunk_exact
+        else:
+            au_tract_trs = create_parcel_overlay(au, lookup, trs_buff)
+        parts.append(au_tract_trs.groupby(['geoid20', 'countyfp', 'route_id'])['population_2050'].sum())
+    tract_pop = pd.concat(parts).groupby(level=['geoid20', 'countyfp', 'route_id']).sum().reset_index()
+    if how == 'points':
+        print(f"Paratransit classification: {n_parcels - n_exact} parcels decided by representative point, "
+              f"{n_exact} by the exact check")
+    return(tract_pop)
+
 
 def create_denom(overlay_tbl):
     """
     Tablulate total regional and county population 2050 into dataframe.
 
     Args:
-     The overlay_tbl: a shape of the overlay of parcelized activity units, tracts, and buffered transit routes.    
+     The overlay_tbl: population_2050 by countyfp, e.g. the tract summary of the overlay of parcelized activity units, tracts, and buffered transit routes.    
 
     """
 
-    reg = overlay_tbl['population_2050'].sum()
-    cnty = overlay_tbl.groupby(['countyfp'])['population_2050'].sum().reset_index()
-    denom = pd.concat([cnty, pd.DataFrame([{'countyfp': 'Region', 'population_2050': reg}])], ignore_index=True) 
+    totals = summary_table.rollup(overlay_tbl, [], 'countyfp', 'route_id', ['population_2050'])
+    denom = totals.xs(summary_table.TOTAL, level='route_id').reset_index()
     denom.rename(columns={'population_2050':'denom_pop50'}, inplace=True)
     return(denom)
 
@@ -91,69 +214,52 @@ def run(config):
         https://www.arcgis.com/sharing/rest/content/items/89fb6e03dbd149b8a3e468d85e74e153/info/metadata/metadata.xml?format=default&output=html (metadata)
 
     """
-    au_tract_trs = create_parcel_overlay(config)
+    # dissolved buffered routes, shared by the overlay and the exported layer
+    trs_buff = get_buffered_routes(config)
+    routes = get_paratransit_routes(config) if config.get('paratransit_classification') == 'points' else None
 
     # group by tract, county, buffer and sum
-    tract_pop = au_tract_trs.groupby(['geoid20', 'countyfp', 'route_id'])['population_2050'].sum().reset_index()
+    tract = parcel_tract.get_tract(config)
+    tract_pop = sum_tract_population(config, trs_buff, parcel_tract.get_lookup(config, tract), routes)
 
     # read table with all EFA columns
     print('reading EFA table')
-    efa_tbl = r"GIS - Sharing\Projects\Transportation\RTP_2026\equity_focus_areas\efa_3groupings_1SD"
-    efa = pd.read_csv(os.path.join(config['user_onedrive'], efa_tbl, "equity_focus_areas_2023.csv"))
+    efa = pd.read_csv(os.path.join(config['user_onedrive'], config['rtp_efa_path'], "equity_focus_areas_2023.csv"))
     efa['geoid20'] = efa['GEOID20'].astype(str)
     
-    # join EFA table to main tract summary
-    print("join table to tract summary")
-    tract_pop_efa = pd.merge(left = tract_pop, right = efa, on='geoid20', how='left')
-
     print("compile table")
 
     # create table with denominators
-    denom_pop = create_denom(overlay_tbl = au_tract_trs)
+    denom_pop = create_denom(overlay_tbl = tract_pop)
 
-    # multiply population 2050 by percent value for each equity category
-    pct_eft_cols = tract_pop_efa.columns[tract_pop_efa.columns.str.endswith('prct_est')]
-    res_cols = [col + "_pop50" for col in pct_eft_cols] # columns with results
-    res_cols = [col.replace('_prct_est_', '_') for col in res_cols]
-
-    tract_pop_efa[res_cols] = tract_pop_efa[pct_eft_cols].multiply(tract_pop_efa['population_2050'], axis=0) 
+    # population 2050 by tract and buffer x percent value for each equity category,
+    # summed by county
+    apportioner = efa_apportion.EfaApportioner(efa, tract.set_index('geoid20')['countyfp'])
+    pop_by_route = tract_pop.pivot_table(index='geoid20', columns='route_id', values='population_2050', aggfunc='sum', fill_value=0)
+    tract_sums = apportioner.tract_sums(apportioner.tract_index(pop_by_route.index), pop_by_route)
+    cnty_sum = apportioner.apportion(tract_sums)
 
-    # # export this file for % source if necessary
-    # tract_pop_efa_out_cols = ['geoid20', 'countyfp', 'route_id', *pct_eft_cols, *res_cols] 
-    # tract_pop_efa_out = tract_pop_efa[tract_pop_efa_out_cols]
-    
-    # create main summary table by county and region
-    main_cols = ['geoid20', 'countyfp', 'route_id', *res_cols]
-    df = tract_pop_efa[main_cols]
-    df = df.fillna(0)
-    
-    # merge county and regional summaries
-    cnty_sum = df.groupby(['countyfp', 'route_id'])[res_cols].sum().reset_index()
-    reg_sum = df.groupby(['route_id'])[res_cols].sum().reset_index()
-    reg_sum['countyfp'] = 'Region'
-    df_res = pd.concat([cnty_sum, reg_sum], ignore_index=True)
-
-    # sum by juris totals & concatentate
-    est_cols = df_res.columns[df_res.columns.str.endswith('pop50')]
-
-    df_res_juris = df_res.groupby(['countyfp']).sum([est_cols]).reset_index()
-    df_res_juris['route_id'] = "Total"
-    df_res = pd.concat([df_res, df_res_juris], ignore_index=True)
-    df_res = df_res.sort_values(by=['countyfp', 'route_id'])
-    df_total = pd.merge(df_res, denom_pop, on='countyfp')
+    res_cols = [col + "_pop50" for col in apportioner.pct_cols] # columns with results
+    res_cols = [col.replace('_prct_est_', '_') for col in res_cols]
+    cnty_sum.columns = res_cols
     
-    # calculate shares
+    # county, regional and inside + outside totals in one rollup
+    df_res = summary_table.rollup(cnty_sum.reset_index(), [], 'countyfp', 'route_id', res_cols)
+
+    # calculate shares of the total population of each jurisdiction
     share_res_cols = [col + "_share" for col in res_cols]
-    df_total[share_res_cols] = df_total[res_cols].div(df_total['denom_pop50'], axis=0)
+    denom = denom_pop.set_index('countyfp')['denom_pop50']
+    df_share = summary_table.shares(df_res, 'route_id', denominator=denom).set_axis(share_res_cols, axis=1)
+    df_total = pd.concat([df_res, df_share], axis=1).reset_index()
+    df_total['denom_pop50'] = denom.reindex(df_total['countyfp']).to_numpy()
+    df_total = df_total[['countyfp', 'route_id', *res_cols, 'denom_pop50', *share_res_cols]]
     df_total = df_total.rename(columns={'countyfp':'jurisdiction', 'route_id':'area'})
 
     # format
-    df_total[est_cols] = df_total[est_cols].round(1)
-    df_total[share_res_cols] = df_total[share_res_cols].applymap(lambda x: f'{x:.1%}')
+    df_total = summary_table.format_table(df_total, res_cols, share_res_cols)
 
     # create file geodatabase for route buffered
     print('export buffered transit routes to gdb')
-    trs_buff = buffer_transit_routes(config)
     utils.export_layer(gdf = trs_buff, config = config, lyr_nm = "paratransit_routes_buff.shp")
     # trs_buff.to_file(r"C:\Users\CLam\github\rtp-spatial-analysis\test-shp\trs_buff.shp")
 
@@ -0,0 +1,204 @@
+"""
+Persisted parcel -> 2020 tract lookup.
+
+Parcel-to-tract assignment does not change within an RTP cycle, so it is
+computed once and kept as a table (``parcel_id`` -> ``geoid20``,
+``countyfp``, ``nearest``) under ``cache_dir/parcel_tract``. The analyses
+attach tracts to parcels with an integer join on ``parcel_id`` instead of a
+spatial join.
+
+The table covers the parcels the analyses read, i.e. those of
+:func:`utils.iter_parcels`, and is built from the same read, so a scheduled
+run loads the parcel layer once for both.
+
+Each parcel is assigned to the tract containing its representative point
+(a point guaranteed to lie inside the parcel), so every parcel gets exactly
+one tract. Parcels whose point falls in no tract (slivers along the
+shoreline) take the nearest tract and are flagged ``nearest``.
+
+The table is versioned by the parcel geodatabase's signature and a content
+hash of the tract layer, so a new parcel or tract layer builds a new table.
+It is built on first use, or ahead of a run with::
+
+    python -m rtp_spatial_analysis.src.parcel_tract [-c CONFIGS_DIR]
+"""
+
+import os
+import time
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+from pathlib import Path
+
+from . import configuration
+from . import elmergeo
+from . import layer_cache
+from . import utils
+
+PARCEL_LAYER = ('au_path', 'draft_parcel_data_rtp_2026')
+
+_lookups = {}
+
+
+def get_tract(config):
+    """
+    Load 2020 tracts from the ElmerGeo mirror in the analysis CRS.
+
+    Returns:
+        geopandas.GeoDataFrame: ``geoid20``, ``countyfp``, ``county_name``
+            and ``tractce20`` of every tract.
+    """
+    tract_columns = ["geoid20", "countyfp", "county_name", "tractce20", "geometry"]
+    return elmergeo.get_layer(config, 'TRACT2020', columns=tract_columns)
+
+
+def assign_tracts(parcels, tract):
+    """
+    Assign every parcel to one tract.
+
+    Args:
+        parcels (geopandas.GeoDataFrame): Parcels with ``parcel_id``.
+        tract (geopandas.GeoDataFrame): Tracts from :func:`get_tract`, in the
+            CRS of ``parcels``.
+
+    Returns:
+        pandas.DataFrame: ``geoid20``, ``countyfp`` and ``nearest`` indexed
+            by ``parcel_id``.
+    """
+    geoms = parcels.geometry.values
+    points = gpd.GeoDataFrame(geometry=shapely.point_on_surface(geoms), crs=parcels.crs)
+    points = utils.points_in_polygon(points, tract, 'in_tract', id_col='geoid20')
+    geoid20 = points['geoid20'].to_numpy(dtype=object)
+
+    # parcels outside every tract take the nearest one
+    missing = np.flatnonzero(~points['in_tract'].to_numpy())
+    if len(missing):
+        tree = shapely.STRtree(tract.geometry.values)
+        src_idx, tract_idx = tree.query_nearest(geoms[missing], all_matches=False)
+        geoid20[missing[src_idx]] = tract['geoid20'].to_numpy()[tract_idx]
+
+    countyfp = tract.drop_duplicates('geoid20').set_index('geoid20')['countyfp'].reindex(geoid20)
+    return pd.DataFrame({
+        'geoid20': geoid20,
+        'countyfp': countyfp.to_numpy(),
+        'nearest': ~points['in_tract'].to_numpy(),
+    }, index=pd.Index(parcels['parcel_id'].to_numpy(), name='parcel_id'))
+
+
+def lookup_path(config, tract):
+    """
+    Path of the lookup table for the current parcel and tract layers.
+
+    Args:
+        config (dict): Configuration dictionary.
+        tract (geopandas.GeoDataFrame): Tracts from :func:`get_tract`.
+
+    Returns:
+        pathlib.Path: Parquet file (CSV without pyarrow) under
+            ``cache_dir/parcel_tract``.
+    """
+    path_name, layer = PARCEL_LAYER
+    parcel_path = Path(f"{config['user_onedrive']}/{config[path_name]}")
+    key = layer_cache.fingerprint(str(parcel_path), layer, layer_cache.source_signature(parcel_path),
+                                  utils.PARCEL_FILTER, layer_cache.frame_signature(tract),
+                                  str(config['epsg_crs']))
+    suffix = '.parquet' if layer_cache.parquet_available() else '.csv'
+    return layer_cache.cache_root(config) / 'parcel_tract' / f"{key}{suffix}"
+
+
+def build_lookup(config, tract=None, persist=True):
+    """
+    Assign the parcels of :func:`utils.iter_parcels` to tracts and persist the table.
+
+    Parcels are read exactly as the analyses read them (in chunks of
+    ``parcel_chunk_size`` when it is set), so the layer preloaded for the
+    steps is reused rather than read again with other columns.
+
+    Args:
+        config (dict): Configuration dictionary.
+        tract (geopandas.GeoDataFrame, optional): Tracts from
+            :func:`get_tract`. Loaded if not given.
+        persist (bool, optional): Write the table to :func:`lookup_path`.
+            Defaults to True.
+
+    Returns:
+        pandas.DataFrame: See :func:`assign_tracts`.
+    """
+    tract = get_tract(config) if tract is None else tract
+    lookup = pd.concat([assign_tracts(parcels, tract) for parcels in utils.iter_parcels(config)])
+
+    path = lookup_path(config, tract)
+    if persist:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # a temp name per process, so steps building the table at the same time never share one
+        tmp_path = path.with_name(f"{path.stem}.{os.getpid()}.tmp")
+        if path.suffix == '.parquet':
+            lookup.to_parquet(tmp_path)
+        else:
+            lookup.to_csv(tmp_path)
+        os.replace(tmp_path, path)
+    _lookups[path] = lookup
+    return lookup
+
+
+def get_lookup(config, tract=None):
+    """
+    Return the parcel -> tract lookup, building it if it does not exist yet.
+
+    A table built here is only written to disk when ``use_disk_cache`` is on.
+
+    Args:
+        config (dict): Configuration dictionary.
+        tract (geopandas.GeoDataFrame, optional): Tracts from
+            :func:`get_tract`. Loaded if not given.
+
+    Returns:
+        pandas.DataFrame: ``geoid20``, ``countyfp`` and ``nearest`` indexed
+            by ``parcel_id``.
+    """
+    tract = get_tract(config) if tract is None else tract
+    path = lookup_path(config, tract)
+    if path not in _lookups:
+        if not path.exists():
+            return build_lookup(config, tract, persist=config.get('use_disk_cache', True))
+        if path.suffix == '.parquet':
+            _lookups[path] = pd.read_parquet(path)
+        else:
+            _lookups[path] = pd.read_csv(path, index_col='parcel_id',
+                                         dtype={'geoid20': str, 'countyfp': str})
+    return _lookups[path]
+
+
+def join_tracts(parcels, lookup, columns=('geoid20', 'countyfp')):
+    """
+    Attach tract columns to parcels through ``parcel_id``.
+
+    Args:
+        parcels (geopandas.GeoDataFrame): Parcels with ``parcel_id``.
+        lookup (pandas.DataFrame): Output of :func:`get_lookup`.
+        columns (sequence, optional): Lookup columns to attach.
+
+    Returns:
+        geopandas.GeoDataFrame: A copy of ``parcels`` with ``columns`` added.
+    """
+    found = lookup.reindex(parcels['parcel_id'].to_numpy())
+    parcels = parcels.copy()
+    for col in columns:
+        parcels[col] = found[col].to_numpy()
+    return parcels
+
+
+def main():
+    config = configuration.load_config()
+    start = time.perf_counter()
+    tract = get_tract(config)
+    lookup = build_lookup(config, tract)
+    print(f"Assigned {len(lookup)} parcels to tracts "
+          f"({int(lookup['nearest'].sum())} by nearest tract) in {time.perf_counter() - start:.1f}s")
+    print(f"Saved to {lookup_path(config, tract)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,51 +1,87 @@
 from . import configuration
-import yaml
-from pathlib import Path
 from . import demo
 from . import density_and_freight
 from . import density_and_signals
 from . import frequent_transit_routes_and_signal
 from . import transit_stop_intersections
-import getpass
 from . import paratransit_bnd
 from . import congestion_measures
+from .scheduler import Layer, Step
+from . import scheduler
+from . import utils
+from . import elmergeo
+from . import soundcast_cache
+from pathlib import Path
 
-def main():
-    file = Path().joinpath(configuration.args.configs_dir, "config.yaml")
+AU_2050 = Layer('activity_units_path', 'peope_and_jobs_2050')
+AU_2024 = Layer('activity_units_path', 'peope_and_jobs_2024')
+TRANSIT_STOPS = Layer('rtp_transit_network_path', 'Transit_Stops_2050')
+TRANSIT_ROUTES = Layer('rtp_transit_network_path', 'transit_routes_2050')
+PARCELS = Layer('au_path', 'draft_parcel_data_rtp_2026', tuple(utils.PARCEL_COLUMNS),
+                utils.PARCEL_FILTER, 'parcel_chunk_size')
+FGTS = Layer('fgtswa_path', 'FGTSWA')
+SIGNALS = Layer('its_signals_path', 'its_signals')
 
-    config = yaml.safe_load(open(file))
+# other files read by the steps, recorded in their fingerprints (see scheduler.step_fingerprint)
+def cities_files(config):
+    return [elmergeo.snapshot_path(config, 'cities')]
 
+def efa_files(config):
+    efa = Path(f"{config['user_onedrive']}/{config['rtp_efa_path']}") / "equity_focus_areas_2023.csv"
+    return [efa, elmergeo.snapshot_path(config, 'TRACT2020')]
 
-    if Path().joinpath("C:/Users/", getpass.getuser(), "PSRC").exists():
-        config['user_onedrive'] = Path().joinpath("C:/Users/", getpass.getuser(), "PSRC")
-    elif Path().joinpath("C:/Users/", getpass.getuser(), "Puget Sound Regional Council").exists():
-        config['user_onedrive'] = Path().joinpath("C:/Users/", getpass.getuser(), "Puget Sound Regional Council")
-    else:   
-        print ("OneDrive path not found")
+def model_run_files(run_dirs):
+    return [f for run_dir in run_dirs for name in soundcast_cache.FILES
+            for f in soundcast_cache.source_files(run_dir, name)]
 
-    if config['run_demo']:
-        demo.run(config)
-        
-    if config['run_density_and_freight']:
-        density_and_freight.run(config)
+def congestion_files(config):
+    return model_run_files([config['2050_model_run_path']])
 
-    if config['run_density_and_signals']:
-        density_and_signals.run(config)
+def congestion_batch_files(config):
+    return model_run_files(config['congestion_model_runs'].values())
 
-    if config['run_frequent_transit_routes_and_signal']:
-        frequent_transit_routes_and_signal.run(config)
-        
-    if config['run_transit_stop_intersect_future_density']:
-        transit_stop_intersections.run_transit_intesection_future_density(config)
-        
-    if config['run_transit_stop_intersect_efa']:
-        transit_stop_intersections.run_transit_intesection_efa(config)
+# analysis steps, their OneDrive input layers and outputs, in the order they
+# run when nothing else constrains them
+STEPS = [
+    Step('demo', 'run_demo', demo.run,
+         inputs=[TRANSIT_STOPS], files=cities_files),
+    Step('density_and_freight', 'run_density_and_freight', density_and_freight.run,
+         inputs=[FGTS, AU_2050, AU_2024],
+         outputs=['density_and_freight.csv']),
+    Step('density_and_signals', 'run_density_and_signals', density_and_signals.run,
+         inputs=[SIGNALS, AU_2050],
+         outputs=['density_and_signals.csv', 'signal_density_summary.csv'],
+         layers=['accessible_ped_signals_in_dense_areas']),
+    Step('frequent_transit_routes_and_signal', 'run_frequent_transit_routes_and_signal',
+         frequent_transit_routes_and_signal.run,
+         inputs=[TRANSIT_ROUTES, SIGNALS],
+         outputs=['tsp_counts.csv', 'ped_signal_counts.csv',
+                  'frequent_transit_routes_and_signal.csv'],
+         layers=['frequent_transit_routes_and_signal.shp']),
+    Step('transit_stop_intersect_future_density', 'run_transit_stop_intersect_future_density',
+         transit_stop_intersections.run_transit_intesection_future_density,
+         inputs=[TRANSIT_STOPS, AU_2050],
+         outputs=['transit_stops_density_intersect.csv']),
+    Step('transit_stop_intersect_efa', 'run_transit_stop_intersect_efa',
+         transit_stop_intersections.run_transit_intesection_efa,
+         inputs=[TRANSIT_STOPS, PARCELS],
+         outputs=['transit_stops_efa_pop_intersect.csv'], files=efa_files),
+    Step('paratransit_boundary', 'run_paratransit_boundary', paratransit_bnd.run,
+         inputs=[TRANSIT_ROUTES, PARCELS],
+         outputs=['population-in-paratransit-boundaries.csv'],
+         layers=['paratransit_routes_buff.shp'], files=efa_files),
+    Step('congestion_measures', 'run_congestion_measures', congestion_measures.run,
+         inputs=[SIGNALS],
+         layers=['congested_fgts', 'congested_links', 'congested_signals'], files=congestion_files),
+    Step('congestion_batch', 'run_congestion_batch', congestion_measures.run_batch,
+         inputs=[SIGNALS],
+         outputs=['congestion_measures_comparison.csv'], files=congestion_batch_files),
+]
 
-    if config['run_paratransit_boundary']:
-        paratransit_bnd.run(config)    
+def main():
+    config = configuration.load_config()
 
-    if config['run_congestion_measures']:
-        congestion_measures.run(config)   
+    scheduler.run_steps(STEPS, config)
 
 
 if __name__ == '__main__':
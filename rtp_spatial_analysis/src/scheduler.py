@@ -0,0 +1,442 @@
+"""
+Dependency-aware scheduler for the ``run.main`` analysis steps.
+
+Each analysis is declared as a :class:`Step` with the OneDrive layers it
+reads and the outputs it writes. The scheduler turns those declarations into
+a small DAG:
+
+* every input layer shared by the enabled steps becomes a *load* node that
+  reads the layer once and stores it in the disk tier of
+  :mod:`layer_cache`, so dependent steps get it as GeoParquet instead of
+  going back to the file geodatabase
+* steps that write to the same output file run one after the other, in
+  declaration order; layers of ``future_system_output.gdb`` are not written
+  by the steps but returned to this process and written once at the end
+  through :class:`export_sink.ExportSink`, so they do not serialize steps
+* everything else runs concurrently in a process pool of
+  ``scheduler_workers`` processes; steps in the pool run with
+  ``scheduler_workers: 1``, so their own process pools (tiled dissolves,
+  batch model runs) do not multiply with it
+
+A wall-clock and peak-RSS summary of every node is printed at the end.
+
+With ``incremental: true`` in the config, every step that completes records
+a fingerprint of what it depends on in ``.step_fingerprints.json`` next to
+its outputs (see :func:`step_fingerprint`). A rerun skips enabled steps whose
+fingerprint is unchanged and whose own output files and geodatabase layers
+still exist, so untouched layers of the output geodatabase are not
+rewritten. Steps that declare no outputs always run.
+"""
+
+import hashlib
+import inspect
+import json
+import multiprocessing
+import os
+import re
+import sys
+import time
+import types
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+
+import pyogrio
+
+from . import export_sink
+from . import layer_cache
+from . import utils
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+Layer = namedtuple("Layer", ["path_name", "layer", "columns", "where", "chunk_size"],
+                   defaults=[None, None, None])
+Layer.__doc__ = """An input layer read through :func:`utils.get_onedrive_layer`.
+
+``chunk_size`` names the config key that switches the layer to streamed
+reads; streamed layers are never loaded whole up front."""
+
+FINGERPRINT_FILE = ".step_fingerprints.json"
+# config keys that change how a step runs but not what it writes
+RUNTIME_KEYS = {
+    "user_onedrive", "scheduler_workers", "incremental", "io_engine", "cache_dir",
+    "use_disk_cache", "layer_cache_memory_mb", "parcel_chunk_size",
+    "elmergeo_snapshot_dir", "elmergeo_offline", "dissolve_tile_ft",
+}
+_CONFIG_KEY = re.compile(r"""config(?:\[\s*|\.get\(\s*)['"]([^'"]+)['"]""")
+
+
+class Step:
+    """
+    One analysis step of the RTP run.
+
+    Args:
+        name (str): Display name of the step.
+        flag (str): Config key that enables the step (e.g. ``run_demo``).
+        func (callable): Module-level function called as ``func(config)``.
+        inputs (list of Layer, optional): OneDrive layers read by the step.
+        outputs (list of str, optional): Config keys or file names of the
+            outputs the step writes. Steps sharing an output are serialized.
+        layers (list of str, optional): Layers the step exports to the output
+            geodatabase (``rtp_output_gdb_name``). They are written through
+            the export sink at the end of the run, so they never serialize
+            steps.
+        config_keys (list of str, optional): Config keys the step depends on
+            beyond those its code reads literally (see :func:`step_fingerprint`).
+        files (callable, optional): ``files(config)`` returning the paths of
+            other files the step reads, e.g. CSV tables or model outputs.
+    """
+
+    def __init__(self, name, flag, func, inputs=(), outputs=(), layers=(), config_keys=(), files=None):
+        self.name = name
+        self.flag = flag
+        self.func = func
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.layers = list(layers)
+        self.config_keys = list(config_keys)
+        self.files = files
+
+    def __repr__(self):
+        return f"Step({self.name!r})"
+
+
+def peak_rss_mb():
+    """
+    Return the peak resident set size of the current process in MB.
+
+    Reads the high-water mark from ``/proc`` on Linux, where the
+    ``ru_maxrss`` of a spawned process still carries the peak of the
+    process that started it; uses :mod:`resource` on other Unix systems and
+    psutil on Windows. Returns None if none of these is available.
+    """
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+        return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        return getattr(info, "peak_wset", info.rss) / 1024 ** 2
+    except ImportError:
+        return None
+
+
+def reset_peak_rss():
+    """
+    Reset the peak resident set size of the current process.
+
+    Writing ``5`` to ``/proc/self/clear_refs`` resets the ``VmHWM`` that
+    :func:`peak_rss_mb` reads, so nodes run one after another in the same
+    process each report their own peak.
+
+    Returns:
+        bool: True if the mark was reset, False where this is not supported.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def step_modules(func):
+    """
+    Return the package modules a step's code depends on.
+
+    Starts from the module defining ``func`` and follows every module of
+    this package it references, directly or through imported names.
+
+    Returns:
+        list of module: Sorted by module name.
+    """
+    prefix = __package__ + "."
+    seen = {}
+    stack = [sys.modules[func.__module__]]
+    while stack:
+        module = stack.pop()
+        if module.__name__ in seen:
+            continue
+        seen[module.__name__] = module
+        for value in vars(module).values():
+            if not isinstance(value, types.ModuleType):
+                name = getattr(value, "__module__", None)
+                value = sys.modules.get(name) if isinstance(name, str) else None
+            if value is not None and value.__name__.startswith(prefix) and value.__name__ != __name__:
+                stack.append(value)
+    return [seen[name] for name in sorted(seen)]
+
+
+def step_fingerprint(step, config):
+    """
+    Fingerprint everything a step's outputs depend on.
+
+    The fingerprint combines:
+
+    * the code version: the source of every package module the step uses
+    * the signature (size, mtime) and read options of its input layers and
+      of the files returned by ``step.files``
+    * the values of the config keys its code reads literally
+      (``config['key']`` or ``config.get('key')``) and of ``step.config_keys``,
+      except the run-time settings in :data:`RUNTIME_KEYS` and ``run_*`` flags
+
+    Args:
+        step (Step): The step.
+        config (dict): Configuration dictionary.
+
+    Returns:
+        str: Hex digest.
+    """
+    code = hashlib.sha1()
+    keys = set(step.config_keys)
+    for module in step_modules(step.func):
+        source = inspect.getsource(module)
+        code.update(module.__name__.encode("utf-8"))
+        code.update(source.encode("utf-8"))
+        keys.update(_CONFIG_KEY.findall(source))
+    keys = sorted(k for k in keys - RUNTIME_KEYS if not k.startswith("run_"))
+
+    layers = []
+    for layer in step.inputs:
+        path = Path(f"{config['user_onedrive']}/{config[layer.path_name]}")
+        layers.append((layer.layer, layer.columns, layer.where, layer_cache.source_signature(path)))
+    files = [(str(path), layer_cache.source_signature(path))
+             for path in (step.files(config) if step.files else [])]
+
+    return layer_cache.fingerprint(code.hexdigest(), layers, files,
+                                   [(k, config.get(k)) for k in keys])
+
+
+def output_dir(config):
+    """Return the folder of the exported CSVs and output geodatabase."""
+    return Path(f"{config['user_onedrive']}/{config['rtp_output_path']}")
+
+
+def _layer_key(name):
+    """A layer name as the output geodatabase stores it (``a.shp`` -> ``a_shp``)."""
+    return re.sub(r"\W", "_", name).lower()
+
+
+def outputs_exist(step, config):
+    """
+    Return True if ``step`` declares outputs and every one of them exists.
+
+    Output files are checked on disk, and output layers in the output
+    geodatabase, so a step whose layer was never written (e.g. lost with a
+    failed flush) runs again. A step without declared outputs never counts
+    as up to date.
+    """
+    if not step.outputs and not step.layers:
+        return False
+    if not all((output_dir(config) / str(config.get(output, output))).exists()
+               for output in step.outputs):
+        return False
+    if step.layers:
+        gdb = output_dir(config) / config['rtp_output_gdb_name']
+        if not gdb.exists():
+            return False
+        written = {_layer_key(name) for name in pyogrio.list_layers(gdb)[:, 0]}
+        return all(_layer_key(layer) in written for layer in step.layers)
+    return True
+
+
+def load_fingerprints(config):
+    """Return the recorded step fingerprints, an empty dict if there are none."""
+    path = output_dir(config) / FINGERPRINT_FILE
+    return json.loads(path.read_text()) if path.exists() else {}
+
+
+def save_fingerprints(config, fingerprints):
+    """Write the step fingerprints next to the outputs."""
+    path = output_dir(config) / FINGERPRINT_FILE
+    tmp_path = path.with_name(path.name + ".tmp")
+    tmp_path.write_text(json.dumps(fingerprints, indent=2, sort_keys=True))
+    os.replace(tmp_path, path)
+
+
+def _load_layer(config, layer):
+    utils.get_onedrive_layer(config, layer.path_name, layer.layer,
+                             columns=layer.columns, where=layer.where)
+
+
+def _run_node(func, args):
+    """
+    Run one DAG node and report its wall-clock time, peak RSS and the
+    layers it exported.
+
+    The peak RSS mark is reset first where the platform allows it, so a node
+    run in the parent process is not charged for the nodes before it.
+    """
+    reset_peak_rss()
+    with export_sink.collect() as sink:
+        start = time.perf_counter()
+        func(*args)
+        return time.perf_counter() - start, peak_rss_mb(), sink.layers
+
+
+def build_graph(steps, config, skip=()):
+    """
+    Build the DAG of load and step nodes for the enabled steps.
+
+    Args:
+        steps (list of Step): Declared steps, in their preferred run order.
+        config (dict): Configuration dictionary; ``step.flag`` keys select
+            the enabled steps.
+        skip (collection of str, optional): Names of enabled steps to leave
+            out, e.g. steps that are up to date.
+
+    Returns:
+        dict: Node name -> ``(func, args, set of prerequisite node names)``.
+    """
+    enabled = [s for s in steps if config.get(s.flag) and s.name not in skip]
+    graph = {}
+
+    # load each input layer once; only worthwhile when other processes
+    # can pick the loaded copy up from the disk tier
+    share_inputs = layer_cache.get_cache(config).cache_dir is not None
+    for step in enabled:
+        deps = set()
+        if share_inputs:
+            for layer in step.inputs:
+                if layer.chunk_size and config.get(layer.chunk_size):
+                    continue
+                node = f"load {layer.layer}"
+                if layer.columns is not None:
+                    node += f" [{', '.join(layer.columns)}]"
+                graph.setdefault(node, (_load_layer, (config, layer), set()))
+                deps.add(node)
+        graph[step.name] = (step.func, (config,), deps)
+
+    # serialize writers of the same output
+    last_writer = {}
+    for step in enabled:
+        for output in step.outputs:
+            if output in last_writer:
+                graph[step.name][2].add(last_writer[output])
+            last_writer[output] = step.name
+
+    return graph
+
+
+def print_summary(results, cumulative=False):
+    """
+    Print the per-node wall-clock and peak-RSS table.
+
+    Args:
+        results (dict): Node name to ``(status, seconds, peak)``.
+        cumulative (bool): Label the peak column as the running peak of the
+            process rather than the peak of each node.
+    """
+    peak_label = "peak MB*" if cumulative else "peak MB"
+    print(f"\n{'step':<50} {'status':<8} {'seconds':>9} {peak_label:>9}")
+    for name, (status, seconds, peak) in results.items():
+        secs = f"{seconds:9.1f}" if seconds is not None else f"{'-':>9}"
+        mb = f"{peak:9.0f}" if peak is not None else f"{'-':>9}"
+        print(f"{name:<50} {status:<8} {secs} {mb}")
+    if cumulative:
+        print("* peak of the whole run up to that node; the mark cannot be reset here")
+
+
+def run_steps(steps, config):
+    """
+    Run the enabled steps, in parallel where their dependencies allow.
+
+    With ``scheduler_workers`` set to 1 the nodes run in this process in
+    dependency order, which is the easiest way to debug a single step. The
+    peak RSS mark is reset before each node; where that is not supported
+    the summary labels the peaks as cumulative.
+    With ``incremental`` set, up-to-date steps are skipped and the
+    fingerprints of the steps that complete are recorded.
+
+    Args:
+        steps (list of Step): Declared steps.
+        config (dict): Configuration dictionary.
+
+    Raises:
+        RuntimeError: If any node failed. Nodes that depend on a failed node
+            are skipped; independent nodes still run to completion.
+    """
+    results = {}
+    incremental = config.get("incremental", False)
+    enabled = [s for s in steps if config.get(s.flag)]
+    if incremental:
+        fingerprints = load_fingerprints(config)
+        for step in enabled:
+            if fingerprints.get(step.name) == step_fingerprint(step, config) and outputs_exist(step, config):
+                results[step.name] = ("unchanged", None, None)
+
+    workers = int(config.get("scheduler_workers", 1))
+    cumulative = workers <= 1 and not reset_peak_rss()
+    # steps running side by side in the pool do not start pools of their own
+    node_config = dict(config, scheduler_workers=1) if workers > 1 else config
+    graph = build_graph(steps, node_config, skip=results)
+    pending = {name: set(deps) for name, (_, _, deps) in graph.items()}
+    sink = export_sink.ExportSink()
+
+    def finish(name, status, seconds=None, peak=None, layers=None):
+        results[name] = (status, seconds, peak)
+        sink.update(layers or {})
+        for other, deps in list(pending.items()):
+            if other in pending and name in deps:
+                if status == "ok":
+                    deps.discard(name)
+                else:
+                    del pending[other]
+                    finish(other, "skipped")
+
+    if workers <= 1:
+        while pending:
+            name = next(n for n, deps in pending.items() if not deps)
+            del pending[name]
+            func, args, _ = graph[name]
+            try:
+                finish(name, "ok", *_run_node(func, args))
+            except Exception as e:
+                print(f"Error in {name}: {e}")
+                finish(name, "failed")
+    else:
+        # a fresh process per node keeps peak RSS attributable to one node
+        with ProcessPoolExecutor(max_workers=workers,
+                                 mp_context=multiprocessing.get_context("spawn"),
+                                 max_tasks_per_child=1) as pool:
+            running = {}
+            while pending or running:
+                for name in [n for n, deps in pending.items() if not deps]:
+                    del pending[name]
+                    func, args, _ = graph[name]
+                    running[pool.submit(_run_node, func, args)] = name
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        finish(name, "ok", *future.result())
+                    except Exception as e:
+                        print(f"Error in {name}: {e}")
+                        finish(name, "failed")
+
+    # layers of failed steps never reached the sink
+    sink.flush(config)
+
+    if incremental:
+        # fingerprint after the run, so files created by the step (e.g.
+        # snapshots) are recorded as they are now
+        for step in enabled:
+            if results.get(step.name, ("",))[0] == "ok":
+                fingerprints[step.name] = step_fingerprint(step, config)
+        save_fingerprints(config, fingerprints)
+
+    print_summary(results, cumulative=cumulative)
+    failed = [name for name, (status, _, _) in results.items() if status == "failed"]
+    if failed:
+        raise RuntimeError(f"Steps failed: {', '.join(failed)}")
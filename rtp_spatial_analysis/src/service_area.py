@@ -0,0 +1,226 @@
+"""
+Multi-distance transit stop service areas.
+
+Instead of buffering the stops once per distance and clipping every parcel or
+hex layer against each buffer, the distance from every feature to its nearest
+stop of each route type is computed once with an STRtree ``query_nearest``.
+Membership of any buffer distance is then a threshold on that distance, so
+adding a buffer distance costs one comparison rather than another overlay.
+
+Three modes are supported:
+
+* ``geometry``: distance from the feature's geometry to the nearest stop. A
+  feature is served if any part of it is within the buffer distance, which
+  matches a simple intersect with the buffered stops.
+* ``centroid``: distance from the feature's centroid, for quick previews.
+* ``exact``: the share of each feature's area inside the buffered stops, for
+  partial-area apportioning. This mode uses the dissolved service-area
+  polygon of each route type and distance, which :func:`get_service_areas`
+  builds once per transit network and keeps on disk.
+"""
+
+import os
+from pathlib import Path
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+from . import layer_cache
+from . import utils
+from . import zonal_weights
+
+# segments per quarter circle of the stop buffers, as in utils.buffer_layer (geopandas default)
+BUFFER_QUAD_SEGS = 16
+
+
+def buffer_distances(config):
+    """
+    Return the configured stop buffer distances in feet.
+
+    Args:
+        config (dict): Configuration dictionary with ``transit_buffer_miles``
+            (buffer name -> distance in miles) and ``mile_in_ft``.
+
+    Returns:
+        dict: Buffer name -> distance in feet, in configured order.
+    """
+    return {name: miles * config['mile_in_ft']
+            for name, miles in config['transit_buffer_miles'].items()}
+
+
+def stop_distances(geoms, stops, route_types, max_distance, how='geometry'):
+    """
+    Distance from each feature to the nearest stop of each route type.
+
+    Args:
+        geoms (geopandas.GeoSeries): Features to measure (parcels, hexes).
+        stops (geopandas.GeoDataFrame): Transit stops with one column per
+            route type; a stop serves a route type when its value is > 0.
+        route_types (list): Route type columns of ``stops``.
+        max_distance (float): Search radius. Features farther than this from
+            every stop of a route type get ``inf``.
+        how (str, optional): ``geometry`` to measure from the feature
+            geometry or ``centroid`` to measure from its centroid.
+            Defaults to ``geometry``.
+
+    Returns:
+        pandas.DataFrame: Distances indexed like ``geoms``, one column per
+            route type.
+    """
+    src = geoms.values
+    if how == 'centroid':
+        src = shapely.centroid(src)
+    elif how not in ('geometry', 'exact'):
+        raise ValueError(f"Unknown service area mode: {how}")
+
+    distances = {}
+    for key in route_types:
+        dist = np.full(len(src), np.inf)
+        tree = shapely.STRtree(stops.geometry.values[stops[key].to_numpy() > 0])
+        (input_idx, _), found = tree.query_nearest(
+            src, max_distance=max_distance, return_distance=True, all_matches=False
+        )
+        dist[input_idx] = found
+        distances[key] = dist
+    return pd.DataFrame(distances, index=geoms.index)
+
+
+def build_service_areas(stops, route_types, distances, simplify_tolerance=0):
+    """
+    Dissolve the buffered stops into one service-area polygon per route type and distance.
+
+    Args:
+        stops (geopandas.GeoDataFrame): Transit stops with route type columns.
+        route_types (list): Route type columns of ``stops``.
+        distances (dict): Buffer name -> buffer distance.
+        simplify_tolerance (float, optional): If > 0, simplify each dissolved
+            polygon with this tolerance, preserving topology. Defaults to 0.
+
+    Returns:
+        geopandas.GeoDataFrame: Columns ``route_type``, ``buffer``,
+            ``distance`` and ``geometry``, in the CRS of ``stops``.
+    """
+    rows = []
+    for key in route_types:
+        points = stops.geometry.values[stops[key].to_numpy() > 0]
+        for name, distance in distances.items():
+            geom = shapely.union_all(shapely.buffer(points, distance, quad_segs=BUFFER_QUAD_SEGS))
+            if simplify_tolerance > 0:
+                geom = shapely.simplify(geom, simplify_tolerance, preserve_topology=True)
+            rows.append({'route_type': key, 'buffer': name, 'distance': distance, 'geometry': geom})
+    return gpd.GeoDataFrame(rows, geometry='geometry', crs=stops.crs)
+
+
+def get_service_areas(config, stops):
+    """
+    Return the dissolved service areas, building and persisting them on first use.
+
+    The polygons are stored under ``cache_dir/service_areas`` (GeoParquet, or
+    GeoPackage without pyarrow) and keyed by a hash of the transit network
+    geodatabase's signature, the buffer distances, route types and
+    simplification tolerance, so a new network or distance rebuilds them.
+
+    Args:
+        config (dict): Configuration dictionary.
+        stops (geopandas.GeoDataFrame): Transit stops read from
+            ``rtp_transit_network_path``.
+
+    Returns:
+        geopandas.GeoDataFrame: See :func:`build_service_areas`.
+    """
+    route_types = list(config['transit_supportive_density'].keys())
+    distances = buffer_distances(config)
+    tolerance = config.get('service_area_simplify_ft', 0)
+    network = Path(f"{config['user_onedrive']}/{config['rtp_transit_network_path']}")
+    key = layer_cache.fingerprint(str(network), layer_cache.source_signature(network),
+                                  route_types, sorted(distances.items()), tolerance, BUFFER_QUAD_SEGS,
+                                  str(stops.crs))
+
+    suffix = '.parquet' if layer_cache.parquet_available() else '.gpkg'
+    path = layer_cache.cache_root(config) / 'service_areas' / f"{key}{suffix}"
+    if path.exists():
+        return gpd.read_parquet(path) if suffix == '.parquet' else utils.read_layer(config, path)
+
+    areas = build_service_areas(stops, route_types, distances, tolerance)
+    if config.get('use_disk_cache', True):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # write under a per-process name, so a concurrent or interrupted
+        # build never leaves a partial file at ``path``
+        tmp_path = path.with_name(f"{path.stem}.{os.getpid()}.tmp{suffix}")
+        if suffix == '.parquet':
+            areas.to_parquet(tmp_path)
+        else:
+            utils.write_layer(config, areas, tmp_path, driver='GPKG')
+        os.replace(tmp_path, path)
+    return areas
+
+
+def service_fractions(geoms, service_areas, candidates):
+    """
+    Share of each feature's area inside the service area of each route type.
+
+    The shares are the zonal weights of the features over each dissolved
+    service area (see :func:`zonal_weights.compute_weights`), computed for
+    the features flagged in ``candidates`` only; the others are 0.
+
+    Args:
+        geoms (geopandas.GeoSeries): Polygon features.
+        service_areas (dict): Route type -> dissolved service-area geometry.
+        candidates (pandas.DataFrame): Boolean frame, one column per route
+            type, marking features that touch the service area.
+
+    Returns:
+        pandas.DataFrame: Area shares between 0 and 1, indexed like ``geoms``.
+    """
+    values = geoms.values
+    fractions = {}
+    for key, served in service_areas.items():
+        hit = np.flatnonzero(candidates[key].to_numpy())
+        zones = gpd.GeoDataFrame({'position': hit}, geometry=values[hit], crs=geoms.crs)
+        weights = zonal_weights.compute_weights(served, zones, 'position')
+        share = np.zeros(len(values))
+        share[weights.index.to_numpy()] = weights.to_numpy()
+        fractions[key] = share
+    return pd.DataFrame(fractions, index=geoms.index)
+
+
+def service_shares(geoms, stops, route_types, distances, how='geometry', service_areas=None):
+    """
+    Served share of every feature for every buffer distance and route type.
+
+    Nearest-stop distances are computed once for the largest buffer and
+    thresholded for each distance.
+
+    Args:
+        geoms (geopandas.GeoSeries): Features to classify.
+        stops (geopandas.GeoDataFrame): Transit stops with route type columns.
+        route_types (list): Route type columns of ``stops``.
+        distances (dict): Buffer name -> buffer distance.
+        how (str, optional): ``geometry``, ``centroid`` or ``exact``.
+            Defaults to ``geometry``.
+        service_areas (geopandas.GeoDataFrame, optional): Dissolved service
+            areas from :func:`get_service_areas`, used by ``exact`` mode.
+            Built on the fly if not given.
+
+    Returns:
+        dict: Buffer name -> DataFrame indexed like ``geoms`` with one column
+            per route type. Values are 1.0/0.0 for ``geometry`` and
+            ``centroid``, and area shares for ``exact``.
+    """
+    nearest = stop_distances(geoms, stops, route_types, max(distances.values()), how=how)
+    if how == 'exact' and service_areas is None:
+        service_areas = build_service_areas(stops, route_types, distances)
+
+    shares = {}
+    for name, distance in distances.items():
+        within = nearest <= distance
+        if how == 'exact':
+            areas = service_areas[service_areas['buffer'] == name]
+            shares[name] = service_fractions(
+                geoms, dict(zip(areas['route_type'], areas.geometry.values)), within
+            )
+        else:
+            shares[name] = within.astype(float)
+    return shares
@@ -0,0 +1,189 @@
+"""
+Local columnar mirror of Soundcast model outputs.
+
+Reading ``network_results.csv``, ``transit_segment_results.csv`` and the
+Emme shapefiles from the network drive dominates the congestion step. The
+first read of each file converts it to Parquet (GeoParquet for the
+shapefiles) under ``cache_dir/soundcast``, with compact dtypes:
+
+* node ids (``i_node``, ``j_node``) as nullable int32
+* ``congestion_category``, ``tod`` and other low-cardinality text columns as
+  categoricals
+* other float64 columns (volumes, times) as float32
+
+Later reads memory-map the Parquet file and read only the requested
+columns. A file is converted again whenever the size or modification time
+of its source changes. Run directories can be converted ahead of a run
+with::
+
+    python -m rtp_spatial_analysis.src.soundcast_cache [RUN_DIR ...] [-c CONFIGS_DIR]
+
+The mirror needs pyarrow and ``use_disk_cache``; without them the source
+files are read directly.
+"""
+
+import argparse
+import json
+import os
+from pathlib import Path
+
+import geopandas as gpd
+import pandas as pd
+
+from . import configuration
+from . import layer_cache
+from . import utils
+
+# Soundcast output files, relative to the run directory
+FILES = {
+    'network_results': 'outputs/network/network_results.csv',
+    'transit_segment_results': 'outputs/transit/transit_segment_results.csv',
+    'emme_links': 'outputs/network/shapefile/emme_links.shp',
+    'emme_tlines': 'outputs/network/shapefile/emme_tlines.shp',
+}
+NODE_COLUMNS = ['i_node', 'j_node']
+CATEGORY_COLUMNS = ['congestion_category', 'tod']
+# text columns with fewer distinct values than this share of rows become categoricals
+CATEGORY_RATIO = 0.5
+
+
+def enabled(config):
+    """Return True if the Parquet mirror is used (pyarrow installed and ``use_disk_cache`` on)."""
+    return layer_cache.parquet_available() and config.get('use_disk_cache', True)
+
+
+def compact_dtypes(df):
+    """
+    Downcast the columns of a Soundcast output table.
+
+    Args:
+        df (pandas.DataFrame): Table as read from the CSV or shapefile.
+
+    Returns:
+        pandas.DataFrame: The same table with int32 node ids, categorical
+            text columns and float32 floats. Geometry is left unchanged.
+    """
+    geometry = df.geometry.name if isinstance(df, gpd.GeoDataFrame) else None
+    for col in df.columns:
+        if col == geometry:
+            continue
+        values = df[col]
+        if col in NODE_COLUMNS:
+            df[col] = pd.to_numeric(values, errors='coerce').astype('Int32')
+        elif col in CATEGORY_COLUMNS:
+            df[col] = values.astype('category')
+        elif values.dtype == object and values.nunique() < CATEGORY_RATIO * len(values):
+            df[col] = values.astype('category')
+        elif values.dtype == 'float64':
+            df[col] = values.astype('float32')
+    return df
+
+
+def source_files(run_dir, name):
+    """The source file of ``name`` and, for shapefiles, its sidecar files."""
+    source = Path(run_dir) / FILES[name]
+    if source.suffix == '.shp':
+        return sorted(source.parent.glob(f"{source.stem}.*"))
+    return [source]
+
+
+def mirror_path(config, run_dir, name):
+    """
+    Return the Parquet mirror of one output file, converting it if it is missing or stale.
+
+    Args:
+        config (dict): Configuration dictionary.
+        run_dir (str or pathlib.Path): Soundcast run directory.
+        name (str): Key of :data:`FILES`.
+
+    Returns:
+        pathlib.Path: The Parquet file.
+    """
+    run_dir = Path(run_dir)
+    source = run_dir / FILES[name]
+    signature = [list(layer_cache.source_signature(f)) for f in source_files(run_dir, name)]
+    root = layer_cache.cache_root(config) / 'soundcast' / layer_cache.fingerprint(str(run_dir.resolve()))
+    path = root / f"{name}.parquet"
+    manifest = root / f"{name}.json"
+    if path.exists() and manifest.exists() and json.loads(manifest.read_text()) == signature:
+        return path
+
+    print(f"Converting {source} to Parquet")
+    if source.suffix == '.shp':
+        table = compact_dtypes(utils.read_layer(config, source))
+    else:
+        table = compact_dtypes(pd.read_csv(source))
+    root.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{name}.{os.getpid()}.tmp")
+    table.to_parquet(tmp_path)
+    os.replace(tmp_path, path)
+    manifest.write_text(json.dumps(signature))
+    return path
+
+
+def _parquet_columns(path, columns):
+    import pyarrow.parquet as pq
+
+    names = pq.read_schema(path).names
+    return [col for col in columns if col in names]
+
+
+def read_table(config, run_dir, name, dtypes):
+    """
+    Read columns of a Soundcast results table.
+
+    Args:
+        config (dict): Configuration dictionary.
+        run_dir (str or pathlib.Path): Soundcast run directory.
+        name (str): ``network_results`` or ``transit_segment_results``.
+        dtypes (dict): Columns to read -> dtype used when reading the CSV
+            directly (None to infer). Columns missing from the file are skipped.
+
+    Returns:
+        pandas.DataFrame: The requested columns.
+    """
+    if not enabled(config):
+        return pd.read_csv(Path(run_dir) / FILES[name], usecols=lambda col: col in dtypes,
+                           dtype={col: dtype for col, dtype in dtypes.items() if dtype is not None})
+    path = mirror_path(config, run_dir, name)
+    return pd.read_parquet(path, columns=_parquet_columns(path, dtypes), memory_map=True)
+
+
+def read_layer(config, run_dir, name, columns=None):
+    """
+    Read a Soundcast Emme shapefile.
+
+    Args:
+        config (dict): Configuration dictionary.
+        run_dir (str or pathlib.Path): Soundcast run directory.
+        name (str): ``emme_links`` or ``emme_tlines``.
+        columns (list, optional): Attribute columns to read. Defaults to
+            None (all columns).
+
+    Returns:
+        geopandas.GeoDataFrame: The layer in its source CRS.
+    """
+    if not enabled(config):
+        return utils.read_layer(config, Path(run_dir) / FILES[name], columns=columns)
+    path = mirror_path(config, run_dir, name)
+    if columns is not None:
+        columns = _parquet_columns(path, list(columns) + ['geometry'])
+    return gpd.read_parquet(path, columns=columns, memory_map=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert Soundcast outputs to the local Parquet mirror")
+    configuration.add_run_args(parser)
+    parser.add_argument('run_dirs', nargs='*',
+                        help='Soundcast run directories; defaults to the runs named in the config')
+    args = parser.parse_args()
+
+    config = configuration.load_config(args.configs_dir)
+    run_dirs = args.run_dirs or [config['2050_model_run_path'], *config.get('congestion_model_runs', {}).values()]
+    for run_dir in dict.fromkeys(run_dirs):
+        for name in FILES:
+            print(mirror_path(config, run_dir, name))
+
+
+if __name__ == '__main__':
+    main()
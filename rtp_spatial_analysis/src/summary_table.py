@@ -0,0 +1,123 @@
+"""
+Inside/outside summary tables with county, region and total rollups.
+
+The transit stop and paratransit summaries report a set of values (people,
+jobs, EFA population) by county and for the region, inside the buffered
+routes, outside them and in total, with each row's share of a total. This
+module builds those tables numerically:
+
+* :func:`rollup` adds the region and total rows to the county cells in a
+  single ``groupby(..., observed=False)``
+* :func:`shares` divides each row by its total row, or by a denominator
+* :func:`format_table` rounds values and renders shares as percentage
+  strings, column by column, and is only applied to the exported copy
+
+Tables stay numeric in memory, so they can be concatenated across buffers
+and scenarios and reused before they are formatted.
+"""
+
+import numpy as np
+import pandas as pd
+
+REGION = 'Region'
+TOTAL = 'Total'
+INSIDE = 'Inside Buffered TRS'
+OUTSIDE = 'Outside Buffered TRS'
+
+
+def _categories(values):
+    """Categories of a column: its own order if categorical, else sorted."""
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return list(values.cat.categories)
+    return sorted(values.dropna().unique())
+
+
+def rollup(df, by, geography, area, values, region=REGION, total=TOTAL):
+    """
+    Sum values by group, geography and area, with region and total rows.
+
+    Each cell of ``df`` is counted four times: in its own (geography, area)
+    row, in the region row of its area, in the total row of its geography
+    and in the region total row. One grouped sum over the stacked rows
+    gives the whole table.
+
+    Args:
+        df (pandas.DataFrame): Long table of the base cells, e.g. population
+            by route type, county and inside/outside area.
+        by (list): Grouping columns kept as they are, e.g. ``Route Type``.
+        geography (str): Geography column, e.g. ``county``.
+        area (str): Area column, e.g. ``Area`` holding inside/outside.
+        values (list): Numeric columns to sum.
+        region (str, optional): Label of the rows summed over all
+            geographies. Defaults to ``Region``.
+        total (str, optional): Label of the rows summed over all areas.
+            Defaults to ``Total``.
+
+    Returns:
+        pandas.DataFrame: ``values`` indexed by ``by``, ``geography`` and
+            ``area``. Geographies and areas keep their categorical order (or
+            are sorted), followed by the region and total labels; every
+            combination is present.
+    """
+    by = list(by)
+    values = list(values)
+    geographies = _categories(df[geography]) + [region]
+    areas = _categories(df[area]) + [total]
+
+    cells = df[by + [geography, area] + values]
+    stacked = pd.concat([cells,
+                         cells.assign(**{geography: region}),
+                         cells.assign(**{area: total}),
+                         cells.assign(**{geography: region, area: total})],
+                        ignore_index=True)
+    stacked[geography] = pd.Categorical(stacked[geography].astype(object), categories=geographies)
+    stacked[area] = pd.Categorical(stacked[area].astype(object), categories=areas)
+    return stacked.groupby(by + [geography, area], observed=False, sort=True)[values].sum()
+
+
+def shares(table, area, values=None, denominator=None, total=TOTAL):
+    """
+    Share of each row of a :func:`rollup` table.
+
+    Args:
+        table (pandas.DataFrame): Output of :func:`rollup`.
+        area (str): Area level of the index.
+        values (list, optional): Columns to divide. Defaults to all columns.
+        denominator (pandas.Series, optional): Denominator of each
+            geography, indexed by the geography labels (region included).
+            Defaults to None: each value is divided by the same column of
+            the total row of its group and geography.
+        total (str, optional): Label of the total rows. Defaults to ``Total``.
+
+    Returns:
+        pandas.DataFrame: Shares, indexed like ``table``.
+    """
+    values = list(table.columns) if values is None else list(values)
+    if denominator is None:
+        totals = table[values].xs(total, level=area)
+        denom = totals.reindex(table.index.droplevel(area)).to_numpy()
+    else:
+        geography = [name for name in table.index.names if name != area][-1]
+        denom = denominator.reindex(table.index.get_level_values(geography)).to_numpy()[:, None]
+    return table[values] / denom
+
+
+def format_table(df, value_cols=(), pct_cols=(), decimals=1):
+    """
+    Round values and render shares as percentage strings, for export.
+
+    Args:
+        df (pandas.DataFrame): Summary table with numeric columns.
+        value_cols (list, optional): Columns rounded to ``decimals``.
+        pct_cols (list, optional): Share columns written as e.g. ``46.0%``.
+        decimals (int, optional): Decimals of both. Defaults to 1.
+
+    Returns:
+        pandas.DataFrame: A formatted copy of ``df``.
+    """
+    df = df.copy()
+    value_cols, pct_cols = list(value_cols), list(pct_cols)
+    df[value_cols] = df[value_cols].round(decimals)
+    for col in pct_cols:
+        df[col] = np.char.mod(f'%.{decimals}f%%', df[col].to_numpy(dtype=float) * 100).astype(object)
+    return df
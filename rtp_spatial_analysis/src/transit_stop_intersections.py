@@ -1,197 +1,205 @@
-import geopandas as gpd
+import numpy as np
 import pandas as pd
-import psrcelmerpy
-from pathlib import Path 
+from . import efa_apportion
+from . import parcel_tract
+from . import service_area
+from . import summary_table
 from . import utils
 
-def get_buffered_transit_stops(config):
+# activity unit hex fields summed by result_au_service and their output names
+AU_FIELDS = ['sum_pop_20', 'sum_jobs_2', 'sum_au_205']
+AU_COLS = ['population', 'jobs', 'activity_units']
+
+def get_transit_stops(config):
     """
-    Get buffered transit stops for 2050 transit network
+    Get transit stops for 2050 transit network
 
     Returns:
 
-        buf2_transit_stops_2050: GeoDataFrame buffered 1/2 mile
-
-        buf4_transit_stops_2050: GeoDataFrame buffered 1/4 mile
+        transit_stops_2050: GeoDataFrame of stops with one column per route type
     """
 
     # 2050 Transit Stops
-    transit_stops_2050 = utils.get_onedrive_layer(config, 'rtp_transit_network_path', 'Transit_Stops_2050')
-    transit_stops_2050 = transit_stops_2050.to_crs(2285)
-    
-    # buffer 1/4 and 1/2 mile
-    buf2_transit_stops_2050 = utils.buffer_layer(transit_stops_2050, config['mile_in_ft']/2)
-    buf4_transit_stops_2050 = utils.buffer_layer(transit_stops_2050, config['mile_in_ft']/4)
+    return utils.get_onedrive_layer(config, 'rtp_transit_network_path', 'Transit_Stops_2050')
 
-    return buf2_transit_stops_2050, buf4_transit_stops_2050
-
-def cal_service_area_stat(df_total, df_within, pct_col_names):
+def get_exact_service_areas(config, transit_stops):
     """
-    get population or activity units within service area, outside service area, and percentage
+    Dissolved service areas for the ``exact`` service area mode, None in the other modes.
     """
+    if config.get('service_area_mode', 'geometry') == 'exact':
+        return service_area.get_service_areas(config, transit_stops)
+    return None
 
-    df_outside = df_total - df_within
-    # percentage
-    within_percent = df_within/df_total
-    within_percent.columns = pct_col_names
-    outside_percent = df_outside/df_total
-    outside_percent.columns = pct_col_names
-    ## total percent should all be 1
-    total_percent = df_total/df_total
-    total_percent.columns = pct_col_names
+def get_service_shares(config, gdf, transit_stops, service_areas=None):
+    """
+    Share of each feature served by each route type, for every configured buffer distance.
 
-    within_all = pd.concat([df_within, within_percent], axis=1)
-    within_all['Area'] = "Inside Buffered TRS"
-    outside_all = pd.concat([df_outside, outside_percent], axis=1)
-    outside_all['Area'] = "Outside Buffered TRS"
-    total_all = pd.concat([df_total, total_percent], axis=1)
-    total_all['Area'] = "Total"
+    Nearest-stop distances are computed once and thresholded for each
+    distance in ``transit_buffer_miles`` (see :mod:`service_area`).
 
-    df = pd.concat([within_all, outside_all, total_all])
-    
-    # formatting
-    df[df_within.columns] = df[df_within.columns].round(1)
-    df[pct_col_names] = df[pct_col_names].map(lambda x: f'{x:.1%}')
+    Args:
+        service_areas: output of :func:`get_exact_service_areas`, for callers
+            that classify several chunks against the same stops; looked up
+            here if not given
 
-    return df
+    Returns:
 
-def result_au_service(config, buffered_stops, buffer_name):
+        dict: buffer name -> DataFrame indexed like gdf, one column per route type
+    """
+    route_types = list(config['transit_supportive_density'].keys())
+    how = config.get('service_area_mode', 'geometry')
+    if service_areas is None:
+        service_areas = get_exact_service_areas(config, transit_stops)
+    return service_area.service_shares(
+        gdf.geometry, transit_stops, route_types,
+        service_area.buffer_distances(config),
+        how=how, service_areas=service_areas,
+    )
+
+def service_area_table(cells, group, geography, value_cols, pct_cols, buffer_name):
+    """
+    Inside/outside/total table with county and region rows, and the share of each row in its total.
 
-    gdf = utils.get_onedrive_layer(config, 'activity_units_path', 'peope_and_jobs_2050')
-    gdf = gdf.to_crs(2285)
+    Args:
+        cells: long table of inside/outside values by group and geography,
+            with an ``Area`` column
+        group: grouping column, e.g. ``Route Type``
+        geography: county column
+        value_cols: value columns
+        pct_cols: names of the share columns, one per value column
+        buffer_name: label of the buffer distance
 
-    sum_fields = ['sum_pop_20', 'sum_jobs_2', 'sum_au_205']
-    total_col = ['population', 'jobs', 'activity_units'] 
-    pct_cols = [i + '_pct' for i in total_col]
-    data = {}
-
-    for key, density in config['transit_supportive_density'].items():
-
-        # number of people and jobs that are in supportive densities
-        gdf_au = gdf[gdf['au_acre']>=density]
-        # by county
-        total_au = gdf_au.groupby('county', observed=False)[sum_fields].sum()
-        total_au.columns = total_col
-        # region
-        total_au.loc['Region',:]=gdf_au[sum_fields].sum().to_list()
-
-        transit_by_type = buffered_stops[buffered_stops[key]>0]
-        gdf = gpd.clip(gdf_au, transit_by_type)
-        df = gdf.drop(columns=['geometry'])
-
-        within = df.groupby('county', observed=False)[sum_fields].sum().fillna(0)
-        within.columns = total_col
-        within.loc['Region',:]=df[sum_fields].sum().to_list()
-        # get activity units inside, outside, and total with percentage
-        data[key] = cal_service_area_stat(total_au, within, pct_cols)
-    
-    # create final dataframe from data dictionary
-    df = pd.concat(data.values(),
-                   keys=data.keys(),
-                   names=['Route Type']).reset_index()
-    df['Buffer'] = buffer_name
-    df = df[['county', 'Route Type', 'Buffer', 'Area'] + total_col + pct_cols].copy()
-
-    df_county = df[df['county']!='Region'].copy()
-    df_region = df[df['county']=='Region'].copy()
+    Returns:
 
-    df_final = pd.concat([df_region,df_county], ignore_index=True)
+        DataFrame with the region rows first, numeric (see :func:`summary_table.format_table`)
+    """
+    table = summary_table.rollup(cells, [group], geography, 'Area', value_cols)
+    pct = summary_table.shares(table, 'Area').set_axis(pct_cols, axis=1)
+    df = pd.concat([table, pct], axis=1).reset_index()
+    df['Buffer'] = buffer_name
+    df = df[[geography, group, 'Buffer', 'Area'] + value_cols + pct_cols]
 
-    return df_final
+    df = df.sort_values([group, 'Area', geography], kind='stable')
+    region = df[geography] == summary_table.REGION
+    return pd.concat([df[region], df[~region]], ignore_index=True)
 
-def get_parcel_with_efa_pop(config):
-    # read population from parcel
-    parcel_columns = ["parcel_id", "population_2050", "geometry"]
-    gdf_parcel = utils.get_onedrive_layer(config, 'au_path', 'draft_parcel_data_rtp_2026')
-    # only keep parcels with population
-    gdf_parcel = gdf_parcel[gdf_parcel['population_2050']>0]
-    gdf_parcel = gdf_parcel[["parcel_id", "population_2050", "geometry"]]
-    
-    # Load tract layer from ElmerGeo
-    tract_columns = ["geoid20", "county_name", "tractce20", "geometry"]
-    eg_conn = psrcelmerpy.ElmerGeoConn()
-    tract = eg_conn.read_geolayer('TRACT2020', project_to_wgs84= False)
-    tract = tract[tract_columns]
+def result_au_service(config, gdf, served, buffer_name):
+    """
+    Activity units in transit supportive densities inside/outside the stop service area.
+
+    Every hex is assigned to each route type's density tier with a NumPy
+    mask and weighted by its served share, then all route types x counties
+    are summed in a single groupby, and the region and total rows are added
+    by :func:`service_area_table`.
+
+    Args:
+        gdf: activity unit hex grid
+        served: DataFrame aligned with gdf, one column per route type, with the
+            share of each hex inside the service area (1/0 for a simple intersect)
+        buffer_name: label of the buffer distance
+    """
 
+    sum_fields = AU_FIELDS
+    total_col = AU_COLS
+    pct_cols = [i + '_pct' for i in total_col]
+    within_cols = [i + '_within' for i in total_col]
+    route_types = list(config['transit_supportive_density'].keys())
+    densities = np.array(list(config['transit_supportive_density'].values()), dtype=float)
+
+    # hex x route type: is the hex in that route type's supportive density
+    dense = gdf['au_acre'].to_numpy(dtype=float)[:, None] >= densities[None, :]
+    hex_idx, type_idx = np.nonzero(dense)
+
+    # long table of (hex, route type) pairs, aggregated in one pass
+    county = gdf['county'].astype('category')
+    values = gdf[sum_fields].to_numpy(dtype=float)[hex_idx]
+    share = served[route_types].to_numpy(dtype=float)[hex_idx, type_idx]
+    pairs = pd.DataFrame(np.hstack([values, values * share[:, None]]), columns=total_col + within_cols)
+    pairs['Route Type'] = pd.Categorical.from_codes(type_idx, categories=route_types)
+    pairs['county'] = pd.Categorical.from_codes(county.cat.codes.to_numpy()[hex_idx], categories=county.cat.categories)
+    sums = pairs.groupby(['Route Type', 'county'], observed=False).sum()
+
+    # activity units inside and outside the service area
+    within = sums[within_cols].set_axis(total_col, axis=1)
+    cells = pd.concat({summary_table.INSIDE: within, summary_table.OUTSIDE: sums[total_col] - within},
+                      names=['Area']).reset_index()
+    return service_area_table(cells, 'Route Type', 'county', total_col, pct_cols, buffer_name)
+
+def get_efa_pct(config):
+    """
+    Load the share of tract population in each equity focus area (``*_prct_est`` columns)
+    """
     # get list of all layers in file: gpd.list_layers(Path(user_path)/config['rtp_efa_path'])
     # 2023 Equity Focused Areas
     efa = pd.read_csv(config['user_onedrive']/ config['rtp_efa_path']/ "equity_focus_areas_2023.csv")
     efa['geoid20'] = efa['GEOID20'].astype(str)
     # filter columns: keep population percentage by efa type
     efa_pct_cols = efa.columns[efa.columns.str.endswith('prct_est')]
-    efa_pop_cols = efa_pct_cols.str.replace('_prct_est', '_efa_pop', regex=False)
-    efa = efa[['geoid20'] + efa_pct_cols.tolist()].fillna(0).copy()
-    
-    # spatial join parcel with tract to get geoid
-    gdf_parcel_tract = gdf_parcel.sjoin(tract, how="left")
-    parcel_tract = gdf_parcel_tract.drop(columns=['geometry'])
+    return efa[['geoid20'] + efa_pct_cols.tolist()].fillna(0).copy()
 
-    # merge parcel_tract with efa: get percentage of population
-    parcel_tract_efa = parcel_tract.merge(efa, on='geoid20', how='inner')
-    # estimate population in each efa by multiplying percentage with total population in each parcel
-    parcel_tract_efa[efa_pop_cols] = parcel_tract_efa[efa_pct_cols].mul(parcel_tract_efa['population_2050'], axis=0)
-    parcel_tract_efa = parcel_tract_efa[['parcel_id', 'geoid20', 'county_name'] + efa_pop_cols.to_list()].copy()
-    # create catgorical type for county_name to keep all counties in the output table
-    parcel_tract_efa['county_name'] = parcel_tract_efa['county_name'].astype('category')
-    
-    # merge back with parcel to get geometry
-    gdf_parcel_efa = gdf_parcel.merge(parcel_tract_efa, on='parcel_id', how='inner')
+def efa_pop_weights(config, parcel, shares):
+    """
+    Population each parcel contributes to the total and to every service area.
 
-    return(gdf_parcel_efa)
+    Args:
+        parcel: parcels with population_2050
+        shares: dict of buffer name -> DataFrame aligned with parcel, one column
+            per route type, with the share of each parcel inside the service area
 
+    Returns:
 
-def result_efa_pop_service(config, parcel, buffered_stops, buffer_name):
+        total: DataFrame with a single ``population`` column
 
-    # list of efa column names
-    efa_pop_cols = parcel.columns[parcel.columns.str.endswith('efa_pop')]
-    # pop_cols = efa_pop_cols.str.replace('_efa_pop', '_pop', regex=False).to_list()
-    pct_cols = efa_pop_cols.str.replace('_efa_pop', '_pct', regex=False).to_list()
-    # total population in each efa
-    efa_total_pop = parcel.groupby('county_name', observed=False)[efa_pop_cols].sum()
-    # region
-    efa_total_pop.loc['Region',:] = parcel[efa_pop_cols].sum().to_list()
-    
-    # dictionary to hold dataframes for each transit type
-    data = {}
-    # [loop through transit types] get population in each efa with service, without service, and total
-    for key in config['transit_supportive_density'].keys():
-        
-        # get buffered stops by transit type
-        transit_by_type = buffered_stops[buffered_stops[key]>0]
-        gdf = gpd.clip(parcel, transit_by_type)
-        
-        df = gdf.drop(columns=['geometry'])
-        # total population in each efa with/without service
-        within = df.groupby('county_name', observed=False)[efa_pop_cols].sum().fillna(0)
-        # region
-        within.loc['Region',:] = df[efa_pop_cols].sum().to_list()
-        # get population inside, outside, and total with percentage
-        data[key] = cal_service_area_stat(efa_total_pop, within, pct_cols)
-
-    # create final dataframe from data dictionary
-    df = pd.concat(data.values(),
-                   keys=data.keys(),
-                   names=['Route Type']).reset_index()
-    df['Buffer'] = buffer_name
-    df = df[['county_name', 'Route Type', 'Buffer', 'Area'] + efa_pop_cols.tolist() + pct_cols].copy()
-
-    df_county = df[df['county_name']!='Region'].copy()
-    df_region = df[df['county_name']=='Region'].copy()
+        within: DataFrame with one (Buffer, Route Type) column per service area,
+            holding population weighted by the served share of each parcel
+    """
+    pop = parcel['population_2050'].to_numpy(dtype=float)
+    within = pd.DataFrame({(buffer_name, key): pop * served[key].to_numpy(dtype=float)
+                           for buffer_name, served in shares.items()
+                           for key in config['transit_supportive_density'].keys()},
+                          index=parcel.index)
+    within.columns.names = ['Buffer', 'Route Type']
+    return pd.DataFrame({'population': pop}, index=parcel.index), within
+
+def result_efa_pop_service(config, efa_total_pop, efa_within_pop, buffer_name):
+    """
+    Population in each EFA inside/outside the stop service area.
 
-    df_final = pd.concat([df_region,df_county], ignore_index=True)
+    Args:
+        efa_total_pop: population in each EFA by county_name
+        efa_within_pop: population in each EFA inside the service area, indexed
+            by Buffer, Route Type and county_name
+        buffer_name: label of the buffer distance
+    """
 
-    return df_final
+    # list of efa column names
+    efa_pop_cols = efa_total_pop.columns.to_list()
+    pct_cols = [col.replace('_efa_pop', '_pct') for col in efa_pop_cols]
+    route_types = list(config['transit_supportive_density'].keys())
+
+    # population in each efa with service and without service, by transit type and county
+    cells_index = pd.MultiIndex.from_product([route_types, efa_total_pop.index],
+                                             names=['Route Type', 'county_name'])
+    within = efa_within_pop.loc[buffer_name].reindex(cells_index).fillna(0)
+    total = efa_total_pop.reindex(cells_index.get_level_values('county_name')).to_numpy()
+    cells = pd.concat({summary_table.INSIDE: within, summary_table.OUTSIDE: total - within},
+                      names=['Area']).reset_index()
+    cells['Route Type'] = pd.Categorical(cells['Route Type'], categories=route_types)
+    return service_area_table(cells, 'Route Type', 'county_name', efa_pop_cols, pct_cols, buffer_name)
 
 # 1. Intersection of transit stops and future density ----
 def run_transit_intesection_future_density(config):
 
     try:
-        buf2_transit_stops_2050, buf4_transit_stops_2050 = get_buffered_transit_stops(config)
+        transit_stops_2050 = get_transit_stops(config)
+        gdf = utils.get_onedrive_layer(config, 'activity_units_path', 'peope_and_jobs_2050')
+        shares = get_service_shares(config, gdf, transit_stops_2050)
         
         # get number of people and jobs that are in supportive densities with service and in those in supportive densities without service (Gap)
-        df1 = result_au_service(config, buf2_transit_stops_2050, 'half mile')
-        df2 = result_au_service(config, buf4_transit_stops_2050, 'quarter mile')
-        df_service_dense = pd.concat([df1, df2])
+        df_service_dense = pd.concat([result_au_service(config, gdf, served, buffer_name)
+                                      for buffer_name, served in shares.items()])
+        df_service_dense = summary_table.format_table(
+            df_service_dense, AU_COLS, [col + '_pct' for col in AU_COLS])
 
         # save to output folder
         utils.export_csv(df_service_dense, config, "transit_stops_density_intersect.csv")
@@ -205,13 +213,41 @@ def run_transit_intesection_future_density(config):
 def run_transit_intesection_efa(config):
 
     try:
-        buf2_transit_stops_2050, buf4_transit_stops_2050 = get_buffered_transit_stops(config)
-
-        gdf_parcel_efa = get_parcel_with_efa_pop(config)
+        transit_stops_2050 = get_transit_stops(config)
+        tract = parcel_tract.get_tract(config)
+        lookup = parcel_tract.get_lookup(config, tract)
+        efa = get_efa_pct(config)
+
+        apportioner = efa_apportion.EfaApportioner(efa, tract.set_index('geoid20')['county_name'])
+        # built once for all parcel chunks
+        service_areas = get_exact_service_areas(config, transit_stops_2050)
+
+        # parcels are processed in chunks (parcel_chunk_size); only their
+        # population by tract is kept, which adds up across chunks
+        total_sums, within_sums = 0, 0
+        for gdf_parcel in utils.iter_parcels(config):
+            parcel = parcel_tract.join_tracts(gdf_parcel, lookup, columns=['geoid20'])
+            # parcel -> tract positions, shared by every group below; parcels
+            # in tracts without EFA data are left out
+            tract_idx = apportioner.tract_index(parcel['geoid20'])
+            keep = tract_idx >= 0
+            parcel, tract_idx = parcel[keep], tract_idx[keep]
+            shares = get_service_shares(config, parcel, transit_stops_2050, service_areas)
+            total, within = efa_pop_weights(config, parcel, shares)
+            total_sums = total_sums + apportioner.tract_sums(tract_idx, total)
+            within_sums = within_sums + apportioner.tract_sums(tract_idx, within)
+
+        # population by group and tract x share of the tract in each EFA
+        efa_total_pop = apportioner.apportion(total_sums).loc['population']
+        efa_within_pop = apportioner.apportion(within_sums)
+        efa_pop_cols = efa_total_pop.columns.str.replace('_prct_est', '_efa_pop', regex=False)
+        efa_total_pop.columns = efa_pop_cols
+        efa_within_pop.columns = efa_pop_cols
             
-        df1 = result_efa_pop_service(config, gdf_parcel_efa, buf2_transit_stops_2050, 'half mile')
-        df2 = result_efa_pop_service(config, gdf_parcel_efa, buf4_transit_stops_2050, 'quarter mile')
-        df_pop_service = pd.concat([df1, df2])
+        df_pop_service = pd.concat([result_efa_pop_service(config, efa_total_pop, efa_within_pop, buffer_name)
+                                    for buffer_name in service_area.buffer_distances(config)])
+        df_pop_service = summary_table.format_table(
+            df_pop_service, efa_pop_cols, efa_pop_cols.str.replace('_efa_pop', '_pct', regex=False))
 
         # save to output folder
         utils.export_csv(df_pop_service, config, "transit_stops_efa_pop_intersect.csv")
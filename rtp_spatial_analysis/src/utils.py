@@ -1,6 +1,12 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 import geopandas as gpd
-import psrcelmerpy
+import numpy as np
+import pyogrio
+import shapely
 from pathlib import Path 
+from . import export_sink
+from . import layer_cache
 
 def buffer_layer(layer_gdf, distance):
     """
@@ -53,13 +59,18 @@ def intersect_layers(df1, df2, how='intersection'):
     """
     return df1.overlay(df2, how= how)
 
-def points_in_polygon(points_gdf, polygons_gdf, col_name, buffer=0):
+def points_in_polygon(points_gdf, polygons_gdf, col_name, buffer=0, id_col=None, chunk_size=100000):
     """
     Check if points intersect polygons and add a boolean column to the result.
 
     Determines whether each point in the points GeoDataFrame intersects with
-    any polygon in the polygons GeoDataFrame. Optionally applies a buffer to
-    the points before checking intersection.
+    any polygon in the polygons GeoDataFrame. Optionally tests whether each
+    point is within a buffer distance of a polygon instead.
+
+    An STRtree over the polygons is built once per call and the points are
+    queried against it in chunks. Bounding-box candidates are confirmed
+    against prepared polygons, and buffered tests use a ``dwithin`` query, so
+    no union of the polygons and no buffer polygons are ever built.
 
     Args:
         points_gdf (geopandas.GeoDataFrame): A GeoDataFrame containing point
@@ -68,37 +79,213 @@ def points_in_polygon(points_gdf, polygons_gdf, col_name, buffer=0):
             geometries to check against.
         col_name (str): The name of the boolean column to add to the points
             GeoDataFrame indicating intersection status.
-        buffer (float, optional): Buffer distance to apply to points before
-            checking intersection, in the units of the coordinate reference
+        buffer (float, optional): Distance within which a point counts as
+            intersecting, in the units of the coordinate reference
             system. Defaults to 0 (no buffer).
+        id_col (str, optional): A column of polygons_gdf to copy onto each
+            matching point, e.g. a city name. Points matching several polygons
+            get the first one's value and points matching none get NA.
+            Defaults to None (no id column added).
+        chunk_size (int, optional): Number of points queried at a time.
+            Defaults to 100000.
 
     Returns:
         geopandas.GeoDataFrame: The input points GeoDataFrame with an additional
-            boolean column indicating whether each point intersects the polygons.
+            boolean column indicating whether each point intersects the polygons,
+            and the id_col column if requested.
 
     Raises:
         Exception: If an error occurs during the intersection check.
     """
     try:
-        if buffer > 0:
-            buffered_points_gdf = points_gdf.copy()
-            buffered_points_gdf.geometry = buffered_points_gdf.geometry.buffer(buffer)
-            intersects = buffered_points_gdf.geometry.intersects(polygons_gdf.geometry.unary_union)
-        else:
-            intersects = points_gdf.geometry.intersects(polygons_gdf.geometry.unary_union)
-        points_gdf[col_name] = intersects
+        polygons = polygons_gdf.geometry.values
+        shapely.prepare(polygons)
+        tree = shapely.STRtree(polygons)
+        points = points_gdf.geometry.values
+
+        # lowest matching polygon index of each point, len(polygons) if none
+        match = np.full(len(points), len(polygons), dtype=np.int64)
+        for start in range(0, len(points), chunk_size):
+            chunk = points[start:start + chunk_size]
+            if buffer > 0:
+                point_idx, poly_idx = tree.query(chunk, predicate='dwithin', distance=buffer)
+            else:
+                point_idx, poly_idx = tree.query(chunk)
+                hit = shapely.intersects(polygons[poly_idx], chunk[point_idx])
+                point_idx, poly_idx = point_idx[hit], poly_idx[hit]
+            np.minimum.at(match, start + point_idx, poly_idx)
+
+        points_gdf[col_name] = match < len(polygons)
+        if id_col is not None:
+            ids = polygons_gdf[id_col].reset_index(drop=True)
+            points_gdf[id_col] = ids.reindex(match).to_numpy()
         return points_gdf
 
     except Exception as e:
         print(f"Error in points_in_polygon: {e}")
         raise
 
+def to_crs_of(gdf, other):
+    """
+    Return gdf in the coordinate reference system of another layer.
+
+    Args:
+        gdf (geopandas.GeoDataFrame): Layer to reproject, e.g. model links
+            read in the CRS of their source shapefile.
+        other (geopandas.GeoDataFrame): Layer whose CRS is used.
+
+    Returns:
+        geopandas.GeoDataFrame: gdf, reprojected if its CRS differs.
+
+    Raises:
+        ValueError: If only one of the two layers has a CRS, so they cannot
+            be compared.
+    """
+    if gdf.crs == other.crs:
+        return gdf
+    if gdf.crs is None or other.crs is None:
+        raise ValueError(f"Cannot compare layers with CRS {gdf.crs} and {other.crs}")
+    return gdf.to_crs(other.crs)
+
+def match_points_to_lines(points_gdf, lines_gdf, distance, columns=None, distance_col='match_distance'):
+    """
+    Match points to their nearest line within a distance.
+
+    The points stay points: instead of buffering them and intersecting the
+    buffers with the lines, a single STRtree ``query_nearest`` over the lines
+    finds the nearest line within ``distance`` of every point. Each point is
+    matched at most once, so no duplicate rows need to be dropped.
+
+    Args:
+        points_gdf (geopandas.GeoDataFrame): Points to match, e.g. signals.
+        lines_gdf (geopandas.GeoDataFrame): Lines to match against, e.g.
+            model links or transit routes. Reprojected to the CRS of
+            points_gdf if it differs (see :func:`to_crs_of`).
+        distance (float): Maximum matching distance, in the units of the
+            coordinate reference system of points_gdf.
+        columns (list, optional): Columns of lines_gdf copied onto the
+            matched points. Defaults to None (all attribute columns). Names
+            already used by points_gdf get a ``_right`` suffix.
+        distance_col (str, optional): Name of the column holding the
+            distance to the matched line. Defaults to ``match_distance``.
+
+    Returns:
+        geopandas.GeoDataFrame: The points within ``distance`` of a line,
+            with ``index_right`` (index of the nearest line), the copied line
+            columns and the distance.
+    """
+    lines_gdf = to_crs_of(lines_gdf, points_gdf)
+    if columns is None:
+        columns = [col for col in lines_gdf.columns if col != lines_gdf.geometry.name]
+    tree = shapely.STRtree(lines_gdf.geometry.values)
+    (point_idx, line_idx), dist = tree.query_nearest(
+        points_gdf.geometry.values, max_distance=distance, return_distance=True, all_matches=False
+    )
+
+    matched = points_gdf.iloc[point_idx].copy()
+    matched['index_right'] = lines_gdf.index.to_numpy()[line_idx]
+    for col in columns:
+        name = f"{col}_right" if col in points_gdf.columns else col
+        matched[name] = lines_gdf[col].to_numpy()[line_idx]
+    matched[distance_col] = dist
+    return matched
+
+def dissolve_geometries(geoms, tile_size=0, workers=1):
+    """
+    Union geometries into a single geometry, optionally tile by tile.
+
+    With a tile size, the geometries are grouped by the square tile of a
+    regular grid their centroid falls in, each tile is unioned on its own
+    (in a process pool when ``workers`` > 1) and the tile results are
+    unioned at the end. Every geometry belongs to exactly one tile, so the
+    result is the same as a single union.
+
+    Args:
+        geoms (array-like): Shapely geometries, e.g. buffered routes.
+        tile_size (float, optional): Side of the grid tiles, in the units of
+            the coordinate reference system. Defaults to 0 (one union).
+        workers (int, optional): Processes used for the tile unions.
+            Defaults to 1.
+
+    Returns:
+        shapely.Geometry: The union of all geometries.
+    """
+    geoms = np.asarray(geoms, dtype=object)
+    if tile_size <= 0 or len(geoms) == 0:
+        return shapely.union_all(geoms)
+
+    centroids = shapely.centroid(geoms)
+    tiles = np.column_stack([np.floor(np.nan_to_num(shapely.get_x(centroids)) / tile_size),
+                             np.floor(np.nan_to_num(shapely.get_y(centroids)) / tile_size)])
+    _, tile_idx = np.unique(tiles, axis=0, return_inverse=True)
+    tile_idx = tile_idx.ravel()
+    groups = [geoms[tile_idx == tile] for tile in range(tile_idx.max() + 1)]
+
+    if workers > 1 and len(groups) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(groups)),
+                                 mp_context=multiprocessing.get_context("spawn")) as pool:
+            parts = list(pool.map(shapely.union_all, groups))
+    else:
+        parts = [shapely.union_all(group) for group in groups]
+    return shapely.union_all(parts)
+
+def io_options(config):
+    """
+    Reader/writer options for the configured I/O engine.
+
+    This is the only place the vector I/O engine is chosen. ``io_engine:
+    pyogrio`` (the default) reads and writes through pyogrio's Arrow path
+    when pyarrow is installed; ``io_engine: fiona`` falls back to fiona.
+
+    Args:
+        config (dict): Configuration dictionary, optionally with ``io_engine``.
+
+    Returns:
+        dict: Keyword arguments for ``geopandas.read_file`` and ``GeoDataFrame.to_file``.
+    """
+    engine = config.get('io_engine', 'pyogrio')
+    if engine == 'pyogrio':
+        return {'engine': 'pyogrio', 'use_arrow': layer_cache.parquet_available()}
+    return {'engine': engine}
+
+def read_layer(config, path, layer=None, **kwargs):
+    """
+    Read a vector layer with the configured I/O engine.
+
+    Args:
+        config (dict): Configuration dictionary, see :func:`io_options`.
+        path (str or pathlib.Path): Path to the dataset (gdb, shp, gpkg, ...).
+        layer (str, optional): Layer name within the dataset. Defaults to None.
+        **kwargs: Other ``geopandas.read_file`` arguments such as ``columns``
+            or ``where``.
+
+    Returns:
+        geopandas.GeoDataFrame: The layer in its source CRS.
+    """
+    return gpd.read_file(Path(path), layer=layer, **io_options(config), **kwargs)
+
+def write_layer(config, gdf, path, layer=None, driver="OpenFileGDB"):
+    """
+    Write a GeoDataFrame with the configured I/O engine.
+
+    Args:
+        config (dict): Configuration dictionary, see :func:`io_options`.
+        gdf (geopandas.GeoDataFrame): The frame to write.
+        path (str or pathlib.Path): Path to the output dataset.
+        layer (str, optional): Layer name within the dataset. Defaults to None.
+        driver (str, optional): OGR driver name. Defaults to "OpenFileGDB".
+    """
+    gdf.to_file(Path(path), layer=layer, driver=driver, **io_options(config))
+
 def export_layer(gdf, config, lyr_nm):
     """
     Export a GeoDataFrame to an OpenFileGDB geodatabase.
 
     Writes the input GeoDataFrame as a layer to an Esri OpenFileGDB geodatabase
-    at a location specified in the configuration dictionary.
+    at a location specified in the configuration dictionary. Inside a
+    scheduled run the layer is handed to the active
+    :class:`export_sink.ExportSink` instead, which writes all layers of the
+    run in one session.
 
     Args:
         gdf (geopandas.GeoDataFrame): The GeoDataFrame to export.
@@ -111,11 +298,16 @@ def export_layer(gdf, config, lyr_nm):
         Exception: If an error occurs during the export operation.
     """
     try:
+        sink = export_sink.active()
+        if sink is not None:
+            sink.add(lyr_nm, gdf)
+            return
+
         user_od = config['user_onedrive']
         output_path = config['rtp_output_path']
         gdb_name = config['rtp_output_gdb_name']
         path_to_output = f"{user_od}/{output_path}/{gdb_name}"
-        gdf.to_file(path_to_output, layer=lyr_nm, driver="OpenFileGDB")
+        write_layer(config, gdf, path_to_output, layer=lyr_nm)
 
     except Exception as e:
         print(f"Error in export_layer: {e}")
@@ -151,13 +343,44 @@ def export_csv(df, config, file_nm, index=False):
         print(f"Error in export_csv: {e}")
         raise
 
-def get_onedrive_layer(config, path_name, layer):
+PARCEL_COLUMNS = ['parcel_id', 'population_2050']
+PARCEL_FILTER = 'population_2050 > 0'
+
+def iter_parcels(config):
+    """
+    Yield the populated 2050 parcels, optionally in chunks.
+
+    Only ``parcel_id``, ``population_2050`` and the geometry of parcels with
+    population are read. With ``parcel_chunk_size`` > 0 in the config the
+    parcels are streamed in chunks of that many features, otherwise the
+    whole (cached) layer is yielded once.
+
+    Args:
+        config (dict): Configuration dictionary with ``au_path``.
+
+    Yields:
+        geopandas.GeoDataFrame: Parcels in ``config['epsg_crs']``.
+    """
+    yield from iter_onedrive_layer(config, 'au_path', 'draft_parcel_data_rtp_2026',
+                                   columns=PARCEL_COLUMNS, where=PARCEL_FILTER,
+                                   chunk_size=config.get('parcel_chunk_size', 0))
+
+def get_onedrive_layer(config, path_name, layer, columns=None, where=None):
     """
     Load a specific layer from a geodatabase file stored in OneDrive.
     
     This function constructs a file path using configuration settings to locate 
     and load a geodatabase layer from OneDrive storage. The loaded data is 
-    automatically reprojected to EPSG:2286 (Washington State Plane North).
+    automatically reprojected to the CRS in ``config['epsg_crs']``
+    (EPSG:2285, Washington State Plane North).
+
+    Column selection and attribute filters are passed down to the reader, so
+    unused columns and rows are never materialised.
+
+    Layers are served from the process-wide :mod:`layer_cache`, so repeated
+    requests for the same layer, CRS, column subset and filter read the
+    geodatabase only once per run (and not at all on reruns when the disk
+    tier holds an up-to-date copy).
     
     Args:
         config (dict): Configuration dictionary containing OneDrive path information.
@@ -165,18 +388,69 @@ def get_onedrive_layer(config, path_name, layer):
         path_name (str): Key name in the config dictionary that contains the relative 
                         path to the geodatabase file from the OneDrive root.
         layer (str): Name of the specific layer to read from the geodatabase file.
+        columns (list, optional): Attribute columns to read. Geometry is always
+                        read. Defaults to None (all columns).
+        where (str, optional): SQL WHERE clause applied by the reader, e.g.
+                        ``"population_2050 > 0"``. It may only refer to columns that
+                        are read. Defaults to None (all rows).
     
     Returns:
         geopandas.GeoDataFrame: The loaded spatial layer with CRS transformed to 
-                               EPSG:2286 (Washington State Plane North).
+                               ``config['epsg_crs']``. The caller owns the returned
+                               frame and may modify it.
     
     """
     try:
         crs = config['epsg_crs']
-        f_path = f"{config['user_onedrive']}/{config[path_name]}"
-        gdb = gpd.read_file(Path(f_path), layer=layer)
-        gdb = gdb.to_crs(crs)
-        return(gdb)
+        f_path = Path(f"{config['user_onedrive']}/{config[path_name]}")
+        cache = layer_cache.get_cache(config)
+
+        def load():
+            cols = list(columns) if columns is not None else None
+            gdb = read_layer(config, f_path, layer=layer, columns=cols, where=where)
+            return gdb.to_crs(crs)
+
+        return cache.get_or_load(cache.key(f_path, layer, crs, columns, where=where), load)
     except Exception as e:
         print(f"Error in get_onedrive_layer: {e}")
         raise
+
+def iter_onedrive_layer(config, path_name, layer, columns=None, where=None, chunk_size=0):
+    """
+    Read a OneDrive geodatabase layer in bounded-size chunks.
+
+    Streams the layer through pyogrio's Arrow reader so that at most
+    ``chunk_size`` features are held in memory at a time. Column selection
+    and the attribute filter are applied by the reader.
+
+    With ``chunk_size`` 0, or when the Arrow path is unavailable (no pyarrow
+    or ``io_engine`` other than pyogrio), the whole layer
+    is read through :func:`get_onedrive_layer` (and its cache) and yielded
+    as a single chunk.
+
+    Args:
+        config (dict): Configuration dictionary, see :func:`get_onedrive_layer`.
+        path_name (str): Key name in the config dictionary of the geodatabase path.
+        layer (str): Name of the layer to read.
+        columns (list, optional): Attribute columns to read. Defaults to None.
+        where (str, optional): SQL WHERE clause applied by the reader.
+        chunk_size (int, optional): Maximum features per chunk. Defaults to 0
+            (no chunking).
+
+    Yields:
+        geopandas.GeoDataFrame: Chunks reprojected to ``config['epsg_crs']``.
+    """
+    if not chunk_size or not io_options(config).get('use_arrow'):
+        yield get_onedrive_layer(config, path_name, layer, columns=columns, where=where)
+        return
+
+    crs = config['epsg_crs']
+    f_path = Path(f"{config['user_onedrive']}/{config[path_name]}")
+    cols = list(columns) if columns is not None else None
+    with pyogrio.open_arrow(f_path, layer=layer, columns=cols, where=where,
+                            batch_size=chunk_size, use_pyarrow=True) as (meta, reader):
+        geom_col = meta['geometry_name'] or 'wkb_geometry'
+        for batch in reader:
+            df = batch.to_pandas()
+            geometry = gpd.GeoSeries.from_wkb(df.pop(geom_col), crs=meta['crs'])
+            yield gpd.GeoDataFrame(df, geometry=geometry).to_crs(crs)
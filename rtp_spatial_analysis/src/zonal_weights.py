@@ -0,0 +1,160 @@
+"""
+Zonal weights of a corridor over a zone grid.
+
+Summing any attribute of the activity unit hex grid (activity units,
+population, jobs, of any year) inside a corridor only needs, for every hex,
+the share of its area inside the corridor. :func:`get_weights` computes that
+sparse hex id -> fraction vector once per corridor and grid and keeps it
+under ``cache_dir/zonal_weights``, keyed by a hash of the corridor geometry,
+the grid and the mode. :func:`weighted_sum` then turns any set of attribute
+columns into totals with a dot product, without another overlay.
+
+Two modes are supported:
+
+* ``exact``: the share of each zone's area inside the corridor. Zones wholly
+  inside get 1 without an intersection; only zones crossing the corridor's
+  edge are intersected with it.
+* ``centroid``: 1 for zones whose centroid is inside the corridor, for quick
+  previews.
+"""
+
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+import shapely
+
+from . import layer_cache
+
+MODES = ('exact', 'centroid')
+
+_weights = {}
+
+
+def geometry_hash(geom):
+    """Hash a geometry by its WKB."""
+    return hashlib.sha1(shapely.to_wkb(geom)).hexdigest()[:20]
+
+
+def compute_weights(corridor, zones, id_col, how='exact'):
+    """
+    Share of each zone inside a corridor.
+
+    Args:
+        corridor (shapely.Geometry): Dissolved corridor polygon, in the CRS
+            of ``zones``.
+        zones (geopandas.GeoDataFrame): Zone polygons, e.g. the hex grid.
+        id_col (str): Column of ``zones`` identifying each zone.
+        how (str, optional): ``exact`` or ``centroid``. Defaults to ``exact``.
+
+    Returns:
+        pandas.Series: ``fraction`` between 0 and 1 indexed by zone id, for
+            the zones with a non-zero share only.
+
+    Raises:
+        ValueError: If ``how`` is not one of :data:`MODES`.
+    """
+    if how not in MODES:
+        raise ValueError(f"Unknown zonal weights mode {how!r}; expected one of {MODES}")
+    geoms = zones.geometry.values
+    shapely.prepare(corridor)
+    if how == 'centroid':
+        points = shapely.centroid(geoms)
+        idx = shapely.STRtree(points).query(corridor, predicate='contains')
+        fractions = np.ones(len(idx))
+    else:
+        idx = shapely.STRtree(geoms).query(corridor, predicate='intersects')
+        inside = shapely.contains_properly(corridor, geoms[idx])
+        fractions = np.ones(len(idx))
+        edge = geoms[idx[~inside]]
+        area = shapely.area(edge)
+        part = shapely.area(shapely.intersection(edge, corridor))
+        # a zone without area that touches the corridor counts as wholly inside
+        fractions[~inside] = np.divide(part, area, out=np.ones_like(part), where=area > 0)
+    keep = fractions > 0
+    return pd.Series(fractions[keep], index=pd.Index(zones[id_col].to_numpy()[idx[keep]], name=id_col),
+                     name='fraction')
+
+
+def weights_path(config, name, corridor, zones, id_col, how='exact'):
+    """
+    Path of the persisted weights of a corridor over a zone grid.
+
+    Args:
+        config (dict): Configuration dictionary.
+        name (str): Label of the corridor, used in the file name.
+        corridor (shapely.Geometry): Dissolved corridor polygon.
+        zones (geopandas.GeoDataFrame): Zone polygons.
+        id_col (str): Zone id column.
+        how (str, optional): ``exact`` or ``centroid``. Defaults to ``exact``.
+
+    Returns:
+        pathlib.Path: Parquet file (CSV without pyarrow) under
+            ``cache_dir/zonal_weights``.
+    """
+    key = layer_cache.fingerprint(geometry_hash(corridor),
+                                  layer_cache.frame_signature(zones[[id_col, zones.geometry.name]]),
+                                  how, str(zones.crs))
+    suffix = '.parquet' if layer_cache.parquet_available() else '.csv'
+    return layer_cache.cache_root(config) / 'zonal_weights' / f"{name}_{key}{suffix}"
+
+
+def get_weights(config, name, corridor, zones, id_col, how='exact'):
+    """
+    Return the weights of a corridor over a zone grid, computing them on first use.
+
+    Weights computed here are only written to disk when ``use_disk_cache``
+    is on.
+
+    Args:
+        config (dict): Configuration dictionary.
+        name (str): Label of the corridor, e.g. ``fgts_corridor``.
+        corridor (shapely.Geometry): Dissolved corridor polygon, in the CRS
+            of ``zones``.
+        zones (geopandas.GeoDataFrame): Zone polygons, e.g. the hex grid.
+        id_col (str): Column of ``zones`` identifying each zone.
+        how (str, optional): ``exact`` or ``centroid``. Defaults to ``exact``.
+
+    Returns:
+        pandas.Series: See :func:`compute_weights`.
+    """
+    path = weights_path(config, name, corridor, zones, id_col, how)
+    if path not in _weights:
+        if path.exists():
+            if path.suffix == '.parquet':
+                weights = pd.read_parquet(path)['fraction']
+            else:
+                weights = pd.read_csv(path, index_col=id_col,
+                                      dtype={id_col: zones[id_col].dtype})['fraction']
+        else:
+            weights = compute_weights(corridor, zones, id_col, how)
+            if config.get('use_disk_cache', True):
+                path.parent.mkdir(parents=True, exist_ok=True)
+                # a temp name per process, so concurrent writers never share one
+                tmp_path = path.with_name(f"{path.stem}.{os.getpid()}.tmp")
+                if path.suffix == '.parquet':
+                    weights.to_frame().to_parquet(tmp_path)
+                else:
+                    weights.to_frame().to_csv(tmp_path)
+                os.replace(tmp_path, path)
+        _weights[path] = weights
+    return _weights[path]
+
+
+def weighted_sum(weights, values):
+    """
+    Sum zone attributes weighted by their share inside a corridor.
+
+    Args:
+        weights (pandas.Series): Output of :func:`get_weights`.
+        values (pandas.DataFrame): Attribute columns indexed by zone id, e.g.
+            activity units of several years. Missing values count as 0.
+
+    Returns:
+        pandas.Series: Weighted total of each column of ``values``.
+    """
+    idx = values.index.get_indexer(weights.index)
+    found = idx >= 0
+    matrix = values.fillna(0).to_numpy(dtype=float)[idx[found]]
+    return pd.Series(weights.to_numpy()[found] @ matrix, index=values.columns)